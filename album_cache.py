@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+lookups = metrics.REGISTRY.counter('album_cache_lookups_total', 'Rendered-album cache lookups, by result (hit, miss, stale).')
+waits = metrics.REGISTRY.counter('album_cache_waits_total', 'Albums that waited for an identical album being rendered by another job.')
+
+
+class AlbumCache:
+    """
+    Content-addressed index of rendered albums: a fingerprint of everything
+    that shapes an album (photo content digests, title, date, romaji, render
+    settings) -> the page files saved for it. Rendering is seeded from the
+    same fingerprint, so a hit is exactly what a re-render would produce.
+
+    One small JSON file per album in index_dir, shared by every worker
+    process. Pages are still expired by the disk sweeper; an entry whose
+    pages are gone is dropped on lookup (or by prune()).
+
+    claim()/release() make sure an album is rendered once even when the same
+    inputs arrive again while it's still rendering: later jobs wait for the
+    first and are then served from the cache. In this process they wait on a
+    Future; other processes see a <key>.lock file and poll.
+    """
+
+    def __init__(self, index_dir, output_dir, stale_lock=600):
+        self.index_dir = index_dir
+        self.output_dir = output_dir
+        self.stale_lock = stale_lock  # seconds; a renderer that crashed doesn't block its album for longer
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future, resolved when this process's renderer releases it
+        os.makedirs(index_dir, exist_ok=True)
+
+    def _index_path(self, key):
+        return os.path.join(self.index_dir, f"{key}.json")
+
+    def _complete(self, pages):
+        return all(
+            os.path.exists(os.path.join(self.output_dir, filename))
+            for files in pages for filename in files.values()
+        )
+
+    def _refresh(self, pages):
+        """
+        Marks an album's pages as just created, so the disk sweeper (which
+        expires pages by mtime) doesn't delete pages we're about to send again.
+        False if any page is already gone.
+        """
+        try:
+            for files in pages:
+                for filename in files.values():
+                    os.utime(os.path.join(self.output_dir, filename))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Dropping unreadable album cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """The saved pages (list of save_page() file dicts) for key, or None."""
+        path = self._index_path(key)
+        pages = self._load(path)
+        if pages is None:
+            lookups.inc(result='miss')
+            return None
+        if not self._refresh(pages):
+            self._remove(path)
+            lookups.inc(result='stale')
+            return None
+        lookups.inc(result='hit')
+        return pages
+
+    def put(self, key, pages):
+        """Records the pages of a finished album (written atomically)."""
+        path = self._index_path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(pages, f)
+        os.replace(tmp, path)
+
+    def _lock_path(self, key):
+        return os.path.join(self.index_dir, f"{key}.lock")
+
+    def _take_lock(self, key):
+        path = self._lock_path(key)
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) < self.stale_lock:
+                        return False
+                except FileNotFoundError:
+                    continue  # Just released
+                self._remove(path)
+        return False
+
+    def claim(self, key):
+        """
+        The pages for key if they're cached, waiting first if another job is
+        rendering the same album. Otherwise None, and the caller is now the
+        album's renderer: it must call release(key, ...) when done.
+        """
+        waited = False
+        while True:
+            pages = self.get(key)
+            if pages is not None:
+                return pages
+            with self._lock:
+                running = self._inflight.get(key)
+                if running is None and self._take_lock(key):
+                    # Another process may have finished it since the lookup above
+                    pages = self._load(self._index_path(key))
+                    if pages is not None and self._refresh(pages):
+                        self._remove(self._lock_path(key))
+                        return pages
+                    self._inflight[key] = Future()
+                    return None
+            if not waited:
+                waits.inc()
+                waited = True
+            if running is not None:
+                running.result()
+            else:
+                time.sleep(0.2)  # Rendering in another process
+            # Then look again: a hit, or (if that render failed) ours to render
+
+    def release(self, key, pages=None):
+        """Ends a claim: records the pages if the album was finished, and wakes waiters."""
+        if pages is not None:
+            self.put(key, pages)
+        with self._lock:
+            self._remove(self._lock_path(key))
+            future = self._inflight.pop(key, None)
+        if future is not None:
+            future.set_result(None)
+
+    def prune(self):
+        """Drops entries whose pages were swept. Returns how many were removed."""
+        removed = 0
+        for entry in os.scandir(self.index_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            pages = self._load(entry.path)
+            if pages is not None and not self._complete(pages):
+                self._remove(entry.path)
+                removed += 1
+        return removed
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# Job states
+QUEUED = 'queued'
+RENDERING = 'rendering'
+PUSHING = 'pushing'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when the album queue (or the user's share of it) is full."""
+
+
+def fingerprint(*parts):
+    """Stable key for a set of inputs (JSON-serializable parts)."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+class AlbumJob:
+    def __init__(self, user_id, func, args):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.state = QUEUED
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.pushing_at = None
+        self.finished_at = None
+        self._func = func
+        self._args = args
+
+    def set_state(self, state):
+        now = time.time()
+        if state == RENDERING and self.started_at is None:
+            self.started_at = now
+        elif state == PUSHING and self.pushing_at is None:
+            self.pushing_at = now
+        elif state in (DONE, FAILED):
+            self.finished_at = now
+        self.state = state
+
+    @property
+    def queue_wait(self):
+        """Seconds spent waiting for a worker."""
+        end = self.started_at or self.finished_at or time.time()
+        return end - self.created_at
+
+    @property
+    def render_time(self):
+        """Seconds between picking the job up and starting to push."""
+        if self.started_at is None:
+            return None
+        end = self.pushing_at or self.finished_at or time.time()
+        return end - self.started_at
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'error': self.error,
+            'created_at': self.created_at,
+            'queue_wait': self.queue_wait,
+            'render_time': self.render_time,
+            'finished_at': self.finished_at,
+        }
+
+    def run(self):
+        self.set_state(RENDERING)
+        try:
+            self._func(*self._args, job=self)
+        except Exception as e:
+            self.error = str(e)
+            self.set_state(FAILED)
+        else:
+            self.set_state(DONE)
+
+
+class AlbumJobQueue:
+    """
+    Fixed-size worker pool with a bounded, per-user fair queue.
+    Users are served round-robin and never have more than one job rendering
+    at a time, so a single user can't hog the workers.
+    """
+
+    def __init__(self, workers=2, max_depth=20, max_per_user=2, history=200):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+        self.history = history
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # user_id -> deque of queued jobs (rotation order)
+        self._depth = 0
+        self._running_users = set()
+        self._jobs = OrderedDict()  # job_id -> job (recent jobs, for status queries)
+        self._threads = []
+
+    def _ensure_started(self):
+        # Started lazily so workers are created in the process that serves requests
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"album-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _user_load(self, user_id):
+        queued = len(self._pending.get(user_id, ()))
+        return queued + (1 if user_id in self._running_users else 0)
+
+    def submit(self, user_id, func, *args):
+        """
+        Queues func(*args, job=job) for user_id and returns the job.
+        Raises QueueFullError instead of blocking when there's no room.
+        """
+        with self._cond:
+            if self._depth >= self.max_depth:
+                raise QueueFullError("album queue is full")
+            if self._user_load(user_id) >= self.max_per_user:
+                raise QueueFullError(f"too many albums in progress for {user_id}")
+
+            self._ensure_started()
+            job = AlbumJob(user_id, func, args)
+            self._pending.setdefault(user_id, deque()).append(job)
+            self._depth += 1
+
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+
+            self._cond.notify()
+            return job
+
+    def _next_job(self):
+        # Round-robin over users that don't already have a job running
+        for user_id, jobs in self._pending.items():
+            if user_id in self._running_users:
+                continue
+            job = jobs.popleft()
+            del self._pending[user_id]
+            if jobs:
+                self._pending[user_id] = jobs  # back of the rotation
+            self._depth -= 1
+            self._running_users.add(user_id)
+            return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+            try:
+                job.run()
+            finally:
+                with self._cond:
+                    self._running_users.discard(job.user_id)
+                    # A queued job for this user may now be runnable
+                    self._cond.notify_all()
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def depth(self):
+        with self._cond:
+            return self._depth
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'max_depth': self.max_depth,
+                'queued': self._depth,
+                'running': len(self._running_users),
+            }
@@ -1,9 +1,13 @@
+import time
+_boot_started = time.perf_counter() # Startup timing starts before the heavy imports
 import os
 import sys
-import threading
 import tempfile
+import functools
 import uuid
-from flask import Flask, request, abort, send_from_directory
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, abort, send_from_directory, jsonify, Response
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import (
@@ -11,7 +15,18 @@ from linebot.models import (
 )
 from dotenv import load_dotenv
 from gemini_service import GeminiService
-from image_service import ImageService
+from image_service import ImageService, LAYOUT_VERSION
+from album_cache import AlbumCache
+from album_jobs import AlbumJobQueue, QueueFullError, PUSHING, fingerprint
+from disk_lifecycle import DiskSweeper
+from session_store import create_session_store
+from ingest import ImageIngest
+from line_delivery import LineDelivery
+import metrics
+
+# Startup phases (seconds), printed by report_startup()
+startup_times = {'imports': time.perf_counter() - _boot_started}
+_phase_started = time.perf_counter()
 
 # Load env
 load_dotenv()
@@ -22,20 +37,128 @@ app = Flask(__name__)
 CHANNEL_ACCESS_TOKEN = os.getenv('CHANNEL_ACCESS_TOKEN')
 CHANNEL_SECRET = os.getenv('CHANNEL_SECRET')
 
+# Album output. Files are named by uuid and never change, so they can be cached forever.
+# Point ALBUM_OUTPUT_DIR at a directory served by nginx/a CDN/an object-store mount and
+# set PUBLIC_IMAGE_BASE_URL to its public URL to take image traffic off this worker.
+OUTPUT_DIR = os.getenv('ALBUM_OUTPUT_DIR', 'static/images')
+PUBLIC_IMAGE_BASE_URL = os.getenv('PUBLIC_IMAGE_BASE_URL')
+IMAGE_MAX_AGE = 365 * 24 * 3600
+# Let a fronting Apache/lighttpd send the file (X-Sendfile) instead of a gunicorn thread
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '0') == '1'
+
 if not CHANNEL_ACCESS_TOKEN or not CHANNEL_SECRET:
     print("Error: LINE Channel Access Token or Secret is missing.")
     # In production, maybe exit, but for dev we might wait for .env update
     
-line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
+# LINE_API_ENDPOINT / LINE_DATA_ENDPOINT point the bot at another LINE API (e.g. a local fake)
+line_bot_api = LineBotApi(
+    CHANNEL_ACCESS_TOKEN,
+    endpoint=os.getenv('LINE_API_ENDPOINT', 'https://api.line.me'),
+    data_endpoint=os.getenv('LINE_DATA_ENDPOINT', 'https://api-data.line.me'),
+)
 handler = WebhookHandler(CHANNEL_SECRET)
 
-# Services
+# Services (cheap to construct: heavy imports and caches load on first use, or in warmup())
 gemini = GeminiService()
 img_svc = ImageService()
 
-# In-memory session store
-# { user_id: { 'status': 'idle'|'collecting', 'location': str, 'date': str, 'images': [path, ...] } }
-sessions = {}
+# Photos are downloaded in the background; the webhook only records where they'll land
+ingest = ImageIngest(
+    CHANNEL_ACCESS_TOKEN,
+    endpoint=line_bot_api.data_endpoint,
+    workers=int(os.getenv('DOWNLOAD_WORKERS', 4)),
+    # Stored once, upright and downscaled; nothing keeps the full-size original
+    transform=img_svc.canonicalize,
+    # Hash/measure each photo as soon as it lands, while the user is still sending more
+    on_done=img_svc.meta.submit,
+)
+DOWNLOAD_WAIT = int(os.getenv('DOWNLOAD_WAIT_SECONDS', 120))
+
+# Big uploads are trimmed to the best photos (local quality score; optionally
+# Gemini picks among the top GEMINI_PICK_TOP_K)
+MAX_ALBUM_PHOTOS = int(os.getenv('MAX_ALBUM_PHOTOS', 30))
+GEMINI_PICK_TOP_K = int(os.getenv('GEMINI_PICK_TOP_K', 0))
+
+# Pushes from every album share one pooled, rate-limited, retrying sender
+delivery = LineDelivery(
+    CHANNEL_ACCESS_TOKEN,
+    endpoint=line_bot_api.endpoint,
+    workers=int(os.getenv('PUSH_WORKERS', 8)),
+    rate=float(os.getenv('PUSH_RATE_PER_SECOND', 2000)), # LINE's push API limit
+)
+
+# Album jobs: fixed worker pool + bounded queue instead of a thread per "完了"
+album_jobs = AlbumJobQueue(
+    workers=int(os.getenv('ALBUM_WORKERS', 2)),
+    max_depth=int(os.getenv('ALBUM_QUEUE_DEPTH', 20)),
+    max_per_user=int(os.getenv('ALBUM_MAX_PER_USER', 2)),
+)
+
+# Session store: in-memory by default; SESSION_STORE=sqlite shares it between gunicorn workers
+sessions = create_session_store()
+
+# Metrics
+ALBUM_TRACE = os.getenv('ALBUM_TRACE', '0') == '1' # Log a stage breakdown per album
+metrics.REGISTRY.gauge('album_queue_depth', 'Album jobs waiting for a worker.', album_jobs.depth)
+metrics.REGISTRY.gauge('album_jobs_running', 'Album jobs being rendered or pushed.', lambda: album_jobs.stats()['running'])
+metrics.REGISTRY.gauge('active_sessions', 'Users with a stored session.', sessions.count)
+metrics.REGISTRY.gauge('line_pushes_pending', 'Pushes queued behind earlier pushes to the same user.', delivery.pending)
+metrics.REGISTRY.gauge('album_downloads_pending', 'Photo downloads queued or in progress.', ingest.pending)
+
+# Disk lifecycle: uploads are deleted once used, pages expire / are evicted over quota
+SESSION_TTL = int(os.getenv('SESSION_TTL_MINUTES', 120)) * 60
+
+def release_uploads(paths, reason):
+    ingest.discard(paths) # Still downloading: delete when done
+    img_svc.meta.forget(paths) # Content entries stay cached; path mappings would pile up
+    disk_sweeper.release(paths, reason=reason)
+
+def expire_idle_sessions():
+    for session in sessions.evict_idle(SESSION_TTL):
+        release_uploads(session['images'], 'session_abandoned')
+
+# Finished albums by input fingerprint: the same photos/title/date are served without re-rendering
+album_cache = AlbumCache(os.getenv('ALBUM_CACHE_DIR', 'tmp/albums'), OUTPUT_DIR)
+
+def before_sweep():
+    expire_idle_sessions()
+    album_cache.prune() # Albums whose pages earlier sweeps removed
+
+disk_sweeper = DiskSweeper(
+    "tmp", OUTPUT_DIR,
+    upload_ttl=int(os.getenv('UPLOAD_TTL_HOURS', 24)) * 3600,
+    output_ttl=int(os.getenv('OUTPUT_TTL_DAYS', 14)) * 24 * 3600,
+    quota_bytes=int(os.getenv('DISK_QUOTA_MB', 1024)) * 1024 * 1024,
+    interval=int(os.getenv('SWEEP_INTERVAL', 300)),
+    on_sweep=before_sweep,
+)
+metrics.REGISTRY.gauge('album_output_bytes', 'Size of rendered pages on disk (last sweep).', lambda: disk_sweeper.output_bytes)
+
+# Time the signature check separately from event dispatch
+_validate_signature = handler.parser.signature_validator.validate
+def _timed_validate_signature(body, signature):
+    with metrics.timed('signature'):
+        return _validate_signature(body, signature)
+handler.parser.signature_validator.validate = _timed_validate_signature
+
+# LINE redelivers events it thinks timed out; handle each event once
+events_redelivered = metrics.REGISTRY.counter('webhook_events_redelivered_total', 'Webhook events skipped as already handled.')
+
+def once_per_event(func):
+    @functools.wraps(func)
+    def wrapper(event):
+        event_id = getattr(event, 'webhook_event_id', None) or f"message:{event.message.id}"
+        if not sessions.first_delivery(event_id):
+            events_redelivered.inc()
+            print(f"Skipping redelivered event {event_id}")
+            return
+        try:
+            return func(event)
+        except Exception:
+            # LINE redelivers after our 500; that delivery must not be skipped
+            sessions.forget_delivery(event_id)
+            raise
+    return wrapper
 
 @app.route("/callback", methods=['POST'])
 def callback():
@@ -44,193 +167,325 @@ def callback():
     app.logger.info("Request body: " + body)
 
     try:
-        handler.handle(body, signature)
+        with metrics.timed('webhook'):
+            handler.handle(body, signature)
     except InvalidSignatureError:
         abort(400)
     return 'OK'
 
+@app.route("/healthz")
+def healthz():
+    return 'OK'
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route("/static/images/<path:filename>")
 def serve_image(filename):
-    return send_from_directory("static/images", filename)
+    # Pages saved with ALBUM_WEBP=1 also have <id>.webp: same URL, smaller body
+    # for clients that accept it
+    served = filename
+    negotiable = img_svc.write_webp and filename.endswith('.jpg')
+    if negotiable and 'image/webp' in request.accept_mimetypes.values():
+        webp = filename[:-len('.jpg')] + '.webp'
+        if os.path.isfile(os.path.join(OUTPUT_DIR, webp)):
+            served = webp
+
+    # Conditional + range requests are handled by send_file; gunicorn streams
+    # the body with sendfile(2) when no range is requested
+    response = send_from_directory(
+        OUTPUT_DIR, served,
+        max_age=IMAGE_MAX_AGE,
+        etag=served, # strong: the name is unique per content
+        conditional=True,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if negotiable:
+        response.vary.add('Accept')
+    disk_sweeper.touch(filename)
+    return response
+
+def public_image_url(filename):
+    if PUBLIC_IMAGE_BASE_URL:
+        return f"{PUBLIC_IMAGE_BASE_URL.rstrip('/')}/{filename}"
+    host_url = os.getenv("HOST_URL", "https://example.com")
+    return f"{host_url}/static/images/{filename}"
+
+@app.route("/jobs")
+def job_stats():
+    return jsonify(album_jobs.stats())
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = album_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
 
 @handler.add(MessageEvent, message=TextMessage)
+@once_per_event
 def handle_text_message(event):
     user_id = event.source.user_id
     text = event.message.text.strip()
-    
-    # Initialize session if not exists
-    if user_id not in sessions:
-        sessions[user_id] = {'status': 'idle', 'images': [], 'location': '', 'date': ''}
-    
-    session = sessions[user_id]
 
     if text.lower() == 'reset':
-        sessions[user_id] = {'status': 'idle', 'images': [], 'location': '', 'date': ''}
+        old = sessions.reset(user_id)
+        release_uploads(old['images'], 'reset')
         line_bot_api.reply_message(
             event.reply_token,
             TextSendMessage(text="リセットしたよ！\nまた「場所」と「時期」を送ってね💖")
         )
         return
 
-    # Status: Idle -> Start collecting info
-    if session['status'] == 'idle':
-        # Assume input format: "Location, Date" or just loose text
-        # Simple parsing logic
-        if "," in text or " " in text:
-             # Very naive parsing, user can improve protocol later
-            try:
-                parts = text.replace("、", ",").split(",")
-                if len(parts) < 2:
-                    parts = text.split(" ")
-                
-                loc = parts[0].strip()
-                date = parts[1].strip() if len(parts) > 1 else "最近"
-                
-                session['location'] = loc
-                session['date'] = date
-                session['status'] = 'collecting'
-                
-                reply = f"「{loc}」の「{date}」だね！把握💖\nじゃあ、写真をどんどん送って！\n送り終わったら「完了」って言ってね✨"
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-            except:
-                line_bot_api.reply_message(
-                     event.reply_token, 
-                     TextSendMessage(text="場所と日時を教えて！\n例：「渋谷, 2024夏」みたいに送ってね😘")
-                )
-        else:
-             line_bot_api.reply_message(
-                 event.reply_token, 
-                 TextSendMessage(text="場所と日時を教えて！\n例：「渋谷, 2024夏」みたいに送ってね😘")
-            )
+    # Decide and update the session atomically; reply after the transaction
+    job = None
+    with sessions.transaction(user_id) as session:
+        # Status: Idle -> Start collecting info
+        if session['status'] == 'idle':
+            reply = "場所と日時を教えて！\n例：「渋谷, 2024夏」みたいに送ってね😘"
+            # Assume input format: "Location, Date" or just loose text
+            # Simple parsing logic
+            if "," in text or " " in text:
+                 # Very naive parsing, user can improve protocol later
+                try:
+                    parts = text.replace("、", ",").split(",")
+                    if len(parts) < 2:
+                        parts = text.split(" ")
 
-    elif session['status'] == 'collecting':
-        if text == "完了" or text == "done":
-            if len(session['images']) == 0:
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text="写真がまだないよ💦 送ってから「完了」してね！")
-                )
-                return
-
-            # Start Processing in Thread
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=f"OK！{len(session['images'])}枚の写真から、最高のアルバムを作るね…🔥\n（枚数が多いと1〜2分かかるかも！ちょっと待ってて！）")
-            )
-            
-            # Copy session data for thread
-            session_data = {
-                'location': session['location'],
-                'date': session['date'],
-                'images': session['images'][:] 
-            }
-            
-            # Reset session immediately
-            session['status'] = 'idle'
-            session['images'] = []
-            
-            # Run background task
-            thread = threading.Thread(target=generate_album_task, args=(user_id, session_data))
-            thread.start()
+                    loc = parts[0].strip()
+                    date = parts[1].strip() if len(parts) > 1 else "最近"
 
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="写真を送るか、「完了」って言ってね！")
-            )
+                    session['location'] = loc
+                    session['date'] = date
+                    session['status'] = 'collecting'
 
-def generate_album_task(user_id, session_data):
+                    reply = f"「{loc}」の「{date}」だね！把握💖\nじゃあ、写真をどんどん送って！\n送り終わったら「完了」って言ってね✨"
+                except:
+                    pass
+
+        elif session['status'] == 'collecting':
+            if text == "完了" or text == "done":
+                if len(session['images']) == 0:
+                    reply = "写真がまだないよ💦 送ってから「完了」してね！"
+                else:
+                    # Copy session data for the job
+                    session_data = {
+                        'location': session['location'],
+                        'date': session['date'],
+                        'images': session['images'][:]
+                    }
+
+                    # Queue the album; reply fast if we're too busy to take it.
+                    # (Re-sent photos are served from album_cache instead of rendering twice)
+                    try:
+                        job = album_jobs.submit(user_id, generate_album_task, user_id, session_data)
+                    except QueueFullError:
+                        reply = "今めっちゃ混んでるみたい💦\nちょっと時間をおいて、もう一回「完了」って送ってね🙏"
+                    else:
+                        reply = f"OK！{len(session['images'])}枚の写真から、最高のアルバムを作るね…🔥\n（枚数が多いと1〜2分かかるかも！ちょっと待ってて！）"
+                        # Reset session
+                        session['status'] = 'idle'
+                        session['images'] = []
+            else:
+                reply = "写真を送るか、「完了」って言ってね！"
+
+    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+    if job is not None:
+        print(f"Queued album job {job.id} for {user_id} (queue depth: {album_jobs.depth()})")
+
+def generate_album_task(user_id, session_data, job=None):
+    trace = metrics.start_trace(f"user={user_id} photos={len(session_data['images'])}")
+    requested_at = job.created_at if job is not None else time.time()
+    # One encoder thread (page N encodes while page N+1 renders); pushes are
+    # queued on the shared delivery, which sends them in order without blocking rendering
+    encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="album-encode")
+    claimed = None # album_cache key this job is rendering
     try:
-        # 1. Select Best Photos (Use all for now)
-        selected_paths = session_data['images']
+        # "完了" can arrive before the last photos are down; wait for exactly this session's
+        with metrics.timed('wait_downloads'):
+            selected_paths = ingest.wait(session_data['images'], timeout=DOWNLOAD_WAIT)
+        if not selected_paths:
+            raise RuntimeError("no photos could be downloaded")
+
+        # 1. Select Best Photos (after dedup, inside the page pipeline)
+        def select_best(paths):
+            if not MAX_ALBUM_PHOTOS or len(paths) <= MAX_ALBUM_PHOTOS:
+                return paths
+            scores = img_svc.score_photos(paths)
+            thumbnails = [img_svc.meta.get(p)['thumbnail'] for p in paths] if GEMINI_PICK_TOP_K else None
+            keep = gemini.select_best_photos(paths, MAX_ALBUM_PHOTOS, scores=scores, thumbnails=thumbnails, top_k=GEMINI_PICK_TOP_K)
+            return [paths[i] for i in keep]
         
         # 2. Get Captions
-        captions = gemini.generate_captions(session_data['location'], session_data['date'])
+        with metrics.timed('captions'):
+            captions = gemini.generate_captions(session_data['location'], session_data['date'])
         title = captions.get('title', 'Travel Memory')
         loc_romaji = captions.get('location_romaji', session_data['location'])
         
-        # 3. Create Images
-        pages = img_svc.create_album_pages(selected_paths, title=title, date=session_data['date'], location_romaji=loc_romaji)
-        
-        messages = []
-        messages.append(TextSendMessage(text=f"{captions.get('comment', 'できたよー！')}\n場所: {loc_romaji}"))
-        
-        host_url = os.getenv("HOST_URL", "https://example.com")
-        
-        for i, page in enumerate(pages):
-            unique_filename = f"{uuid.uuid4()}.jpg"
-            output_path = os.path.join("static/images", unique_filename)
-            page.save(output_path, quality=85) # slightly lower quality for speed
-            
-            image_url = f"{host_url}/static/images/{unique_filename}"
-            messages.append(ImageSendMessage(original_content_url=image_url, preview_image_url=image_url))
-        
-        # Chunk messages
-        def chunk_list(l, n):
-            for i in range(0, len(l), n):
-                yield l[i:i + n]
+        # Everything that shapes the pages. It seeds the layout, so the same
+        # inputs always render the same album, and keys the album cache.
+        digests = [img_svc.meta.get(p)['digest'] for p in selected_paths]
+        album_key = fingerprint(LAYOUT_VERSION, digests, title, session_data['date'], loc_romaji,
+                                MAX_ALBUM_PHOTOS, GEMINI_PICK_TOP_K, img_svc.preview_max_side, img_svc.write_webp)
 
-        for chunk in chunk_list(messages, 5):
-            line_bot_api.push_message(user_id, chunk)
-            
-    except Exception as e:
-        app.logger.error(f"Error processing album: {e}")
-        try:
-            line_bot_api.push_message(
-                user_id,
-                TextSendMessage(text="ごめん！アルバム作成中にエラーが出ちゃった💦 もう一回試してみて！")
+        def page_message(files):
+            return ImageSendMessage(
+                original_content_url=public_image_url(files['original']),
+                preview_image_url=public_image_url(files['preview'])
             )
-        except:
-            pass
 
+        saved = [] # save_page() files per page, in order (one encoder thread)
+        def save_page(page):
+            files = img_svc.save_page(page, OUTPUT_DIR, str(uuid.uuid4()))
+            saved.append(files)
+            return page_message(files)
+
+        first_page_sent = []
+        def push(messages):
+            started = time.perf_counter()
+            def pushed(future):
+                if future.exception() is not None:
+                    return
+                metrics.record('push', time.perf_counter() - started)
+                if not first_page_sent and isinstance(messages[-1], ImageSendMessage):
+                    first_page_sent.append(True)
+                    metrics.time_to_first_page.observe(time.time() - requested_at)
+            future = delivery.push(user_id, messages)
+            future.add_done_callback(metrics.bind_trace(pushed))
+            return future
+
+        # The caption text goes out while the pages render
+        comment = TextSendMessage(text=f"{captions.get('comment', 'できたよー！')}\n場所: {loc_romaji}")
+        pushes = [push([comment])]
+
+        # Waits if the same album is rendering in another job right now
+        cached = album_cache.claim(album_key)
+        if cached is None:
+            claimed = album_key # Ours to render; released in finally if we don't finish
         else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="写真を送るか、「完了」って言ってね！")
-            )
+            # Rendered before (re-sent photos, a retry, "make it again"): just send the pages
+            print(f"Album cache hit for {user_id}: {len(cached)} pages")
+            if job is not None:
+                job.set_state(PUSHING)
+            messages = [page_message(files) for files in cached]
+            pushes += [push(messages[i:i + 5]) for i in range(0, len(messages), 5)]
+            for f in pushes:
+                f.result()
+            return
+
+        # 3. Create Images, streaming: encode + push each batch as soon as it's ready
+        encoding = deque() # encode futures, in page order
+        ready = [] # encoded, not yet pushed
+        batch_size = 1 # The first page goes out alone (time-to-first-page); then full pushes of 5
+
+        def flush(final=False):
+            nonlocal batch_size
+            while encoding and (final or encoding[0].done()):
+                ready.append(encoding.popleft().result())
+            while ready and (len(ready) >= batch_size or final):
+                pushes.append(push(ready[:batch_size]))
+                del ready[:batch_size]
+                batch_size = 5
+            for f in pushes:
+                if f.done():
+                    f.result() # Stop rendering if a push already failed
+
+        pages = img_svc.iter_album_pages(selected_paths, title=title, date=session_data['date'], location_romaji=loc_romaji,
+                                         seed=int(album_key[:16], 16), select=select_best)
+        for page in pages:
+            encoding.append(encoder.submit(metrics.bind_trace(save_page), page))
+            flush()
+
+        if job is not None:
+            job.set_state(PUSHING)
+
+        flush(final=True) # Every page is saved now
+        album_cache.release(album_key, saved) # Jobs waiting for this album can send it
+        claimed = None
+        for f in pushes:
+            f.result()
+            
+    except Exception as e:
+        app.logger.error(f"Error processing album: {e}")
+        # Goes out after whatever was already queued for this user
+        delivery.push(user_id, [TextSendMessage(text="ごめん！アルバム作成中にエラーが出ちゃった💦 もう一回試してみて！")])
+        raise
+    finally:
+        encoder.shutdown(wait=True)
+        if claimed is not None:
+            album_cache.release(claimed) # Failed: a waiting job renders it instead
+        # Uploads aren't needed once the album is done (or has failed)
+        release_uploads(session_data['images'], 'album_done')
+        metrics.end_trace()
+        if ALBUM_TRACE:
+            print(trace.summary())
 
 @handler.add(MessageEvent, message=ImageMessage)
+@once_per_event
 def handle_image_message(event):
     user_id = event.source.user_id
-    if user_id not in sessions:
-        sessions[user_id] = {'status': 'idle', 'images': [], 'location': '', 'date': ''}
-    
-    session = sessions[user_id]
-    
-    if session['status'] != 'collecting':
+    if sessions.get(user_id)['status'] != 'collecting':
         line_bot_api.reply_message(
             event.reply_token,
             TextSendMessage(text="まずは「場所」と「日時」を教えてね！📸")
         )
         return
 
-    # Save image
-    message_content = line_bot_api.get_message_content(event.message.id)
-    ext = "jpg" # Default
-    # Could check content provider, but generally jpg/png
-    
-    tmp_filename = f"{uuid.uuid4()}.{ext}"
-    tmp_path = os.path.join("tmp", tmp_filename)
-    
-    with open(tmp_path, 'wb') as fd:
-        for chunk in message_content.iter_content():
-            fd.write(chunk)
-            
-    session['images'].append(tmp_path)
-    
+    # Reserve the file name now and download in the background, so this
+    # webhook returns right away even during a burst of photos.
+    # Named after the message, so the same photo is never stored twice. Every
+    # upload (JPEG, PNG, ...) is re-encoded to upload_format, so the extension is known up front
+    tmp_path = os.path.join("tmp", f"{event.message.id}.{img_svc.upload_ext}")
+
+    # Queued before it joins the session, so a "完了" that sees it also waits for it
+    download = ingest.submit(event.message.id, tmp_path)
+    # Atomic: other photos of the same batch may be landing in other workers
+    count = sessions.append_image(user_id, tmp_path)
+    if count is None:
+        # Reset (or "完了") since the check above
+        if download is not None:
+            release_uploads([tmp_path], 'reset')
+        return
+    metrics.photos_received.inc()
+
     # Optional: Acknowledge every image? Or silent?
     # Sending reply for every image might be annoying if they simulate bulk upload.
     # LINE user sends 5 images -> 5 webhook events.
     # We can rely on user sending "done".
     # But usually good to give feedback occasionally? No, simpler is better.
     # Just silent logging.
-    print(f"Received image for {user_id}. Count: {len(session['images'])}")
+    print(f"Received image for {user_id}. Count: {count}")
 
 
 # Create dirs (Ensure these exist for Gunicorn too)
 os.makedirs("tmp", exist_ok=True)
-os.makedirs("static/images", exist_ok=True)
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+startup_times['app'] = time.perf_counter() - _phase_started
+
+def warmup():
+    """
+    Loads what the first album would otherwise pay for (Gemini SDK, scipy,
+    fonts, sprite atlas, seasonal backgrounds). gunicorn.conf.py runs this
+    once in the master, so forked workers share it.
+    """
+    started = time.perf_counter()
+    gemini.warmup()
+    img_svc.warmup()
+    startup_times['warmup'] = time.perf_counter() - started
+
+def start_background():
+    """Starts per-process background threads; threads don't survive a fork, so call after it."""
+    disk_sweeper.start()
+
+def report_startup():
+    phases = ' '.join(f"{name}={seconds:.2f}s" for name, seconds in startup_times.items())
+    print(f"Startup (pid {os.getpid()}): {phases} total={sum(startup_times.values()):.2f}s")
 
 if __name__ == "__main__":
+    warmup()
+    start_background()
+    report_startup()
     port = int(os.environ.get('PORT', 8000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,257 @@
+"""
+Reproducible album benchmark on synthetic photo corpora.
+
+Builds deterministic corpora of realistic-size (12 MP) JPEGs with mixed
+orientations (portrait, landscape, EXIF-rotated) and planted near-duplicates,
+then times each ImageService stage (dedup, decode, per-page render, encode)
+for every album size. Each size runs in a fresh subprocess so peak RSS is
+per album.
+
+    python bench_album.py                              # 5/20/50/200 photos
+    python bench_album.py --sizes 5,20 --out bench.json
+    python bench_album.py --baseline bench.json        # exit 1 on regression
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+CORPUS_DIR = "bench_corpus"
+PHOTO_SIZE = (4000, 3000) # 12 MP
+DUPLICATE_RATE = 0.15
+STAGES = ('dedup', 'decode', 'render_page', 'encode')
+
+
+def _synthetic_photo(rng):
+    """A photo-like image: smooth colour field, block detail and sensor-ish noise."""
+    w, h = PHOTO_SIZE
+    # Low-res structure upscaled (smooth gradients), like real scenes
+    small = rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize((w, h), Image.BICUBIC)
+    arr = np.asarray(img, dtype=np.int16)
+    # Mid-frequency detail + noise, so JPEG entropy is in the range of real photos
+    detail = rng.integers(-25, 25, (h // 8, w // 8, 1), dtype=np.int16).repeat(8, 0).repeat(8, 1)
+    noise = rng.integers(-6, 6, (h, w, 1), dtype=np.int16)
+    return Image.fromarray(np.clip(arr + detail + noise, 0, 255).astype(np.uint8))
+
+
+def _near_duplicate(img, rng):
+    """Same shot, slightly reframed and re-exposed (burst / re-sent photo)."""
+    w, h = img.size
+    dx, dy = rng.integers(0, 60, 2)
+    out = img.crop((dx, dy, w - 60 + dx, h - 60 + dy)).resize((w, h), Image.BILINEAR)
+    return out.point(lambda v: min(255, int(v * 1.04)))
+
+
+def _peak_rss_mb():
+    # VmHWM is this process's own high-water mark; ru_maxrss can carry over the
+    # parent's peak across fork/exec on Linux
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build_corpus(count, seed=0):
+    """
+    Writes (or reuses) a deterministic corpus and returns its manifest:
+    {'paths': [...], 'planted_duplicates': n}.
+    """
+    corpus = os.path.join(CORPUS_DIR, f"n{count}_s{seed}")
+    manifest_path = os.path.join(corpus, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    os.makedirs(corpus, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    originals = []
+    paths = []
+    planted = 0
+    for i in range(count):
+        if originals and rng.random() < DUPLICATE_RATE:
+            # Duplicates keep their original's orientation, like a real burst
+            original, kind = originals[rng.integers(len(originals))]
+            img = _near_duplicate(original, rng)
+            planted += 1
+        else:
+            img = _synthetic_photo(rng)
+            kind = i % 4
+            originals.append((img, kind))
+
+        # Mixed orientations: landscape, portrait, and EXIF-rotated landscape
+        exif = Image.Exif()
+        if kind == 1:
+            img = img.transpose(Image.ROTATE_90)
+        elif kind == 2:
+            exif[0x0112] = 6 # camera held upright, pixels stored sideways
+        elif kind == 3:
+            exif[0x0112] = 8
+
+        path = os.path.join(corpus, f"img_{i:04d}.jpg")
+        img.save(path, quality=90, exif=exif)
+        paths.append(path)
+        print(f"\rBuilding corpus n={count}: {i + 1}/{count}", end='', file=sys.stderr)
+    print(file=sys.stderr)
+
+    manifest = {'paths': paths, 'planted_duplicates': planted}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def run_album(manifest, prefetch=False):
+    """Renders + encodes one album and returns its measurements (runs in a subprocess)."""
+    import metrics
+    from image_service import ImageService
+
+    # Count Pillow image objects created during the album
+    allocations = [0]
+    init = Image.Image.__init__
+    def counting_init(self, *args, **kwargs):
+        allocations[0] += 1
+        init(self, *args, **kwargs)
+    Image.Image.__init__ = counting_init
+
+    svc = ImageService()
+    # One-time per-process work (fonts, sprite atlas, backgrounds, scipy) isn't part of an album
+    svc.warmup()
+    paths = manifest['paths']
+    if prefetch:
+        # Simulate upload-time hashing (PhotoMetaCache filled before "完了")
+        for p in paths:
+            svc.meta.submit(p)
+        for p in paths:
+            svc.meta.get(p)
+
+    allocations[0] = 0
+    dropped_before = metrics.duplicates_dropped.value()
+    tracemalloc.start()
+    trace = metrics.start_trace()
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as out_dir:
+        pages = svc.create_album_pages(paths, title="ベンチ旅行💖", date="2024夏", location_romaji="Shibuya", seed=0)
+        for i, page in enumerate(pages):
+            svc.save_page(page, out_dir, f"page_{i}")
+    wall = time.perf_counter() - started
+    metrics.end_trace()
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    svc.close()
+
+    return {
+        'photos': len(paths),
+        'planted_duplicates': manifest['planted_duplicates'],
+        'duplicates_dropped': metrics.duplicates_dropped.value() - dropped_before,
+        'pages': len(pages),
+        'wall_s': wall,
+        'stages': {
+            stage: {'total_s': total, 'count': count, 'mean_s': total / count}
+            for stage, (total, count) in trace.stages.items()
+        },
+        'peak_rss_mb': _peak_rss_mb(),
+        'python_heap_peak_mb': py_peak / (1024 * 1024),
+        'image_allocations': allocations[0],
+    }
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """
+    Prints new vs baseline per album size; returns a list of regressions
+    (slower by more than tolerance and by more than min_delta seconds/MB).
+    """
+    regressions = []
+    old_by_size = {r['photos']: r for r in baseline['results']}
+    print(f"\n{'photos':>6} {'metric':<22} {'baseline':>10} {'now':>10} {'change':>8}")
+    for r in results['results']:
+        old = old_by_size.get(r['photos'])
+        if old is None:
+            continue
+        rows = [('wall_s', old['wall_s'], r['wall_s']), ('peak_rss_mb', old['peak_rss_mb'], r['peak_rss_mb'])]
+        for stage in STAGES:
+            if stage in old['stages'] and stage in r['stages']:
+                rows.append((f"{stage}.total_s", old['stages'][stage]['total_s'], r['stages'][stage]['total_s']))
+        for name, before, now in rows:
+            change = (now - before) / before if before else 0.0
+            flag = ''
+            if change > tolerance and now - before > min_delta:
+                flag = '  REGRESSION'
+                regressions.append((r['photos'], name, before, now))
+            print(f"{r['photos']:>6} {name:<22} {before:>10.3f} {now:>10.3f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='5,20,50,200', help='album sizes (photos), comma separated')
+    parser.add_argument('--seed', type=int, default=0, help='corpus seed')
+    parser.add_argument('--prefetch', action='store_true', help='hash photos before the album starts, like uploads do')
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed slowdown vs baseline (0.15 = 15%%)')
+    parser.add_argument('--min-delta', type=float, default=0.05, help='ignore changes smaller than this (seconds / MB)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per size; the fastest run is kept')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS) # internal: manifest path for a worker run
+    args = parser.parse_args()
+
+    if args.run_one:
+        with open(args.run_one) as f:
+            manifest = json.load(f)
+        print(json.dumps(run_album(manifest, prefetch=args.prefetch)))
+        return
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpu_count': os.cpu_count(),
+        'render_processes': int(os.getenv('RENDER_PROCESSES', 0)),
+        'resize_threads': int(os.getenv('RESIZE_THREADS', 1)),
+        'prefetch': args.prefetch,
+        'results': [],
+    }
+    for size in [int(s) for s in args.sizes.split(',')]:
+        build_corpus(size, seed=args.seed)
+        manifest_path = os.path.join(CORPUS_DIR, f"n{size}_s{args.seed}", "manifest.json")
+        cmd = [sys.executable, os.path.abspath(__file__), '--run-one', manifest_path]
+        if args.prefetch:
+            cmd.append('--prefetch')
+        # Fresh process per run: peak RSS and caches don't leak between runs
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+        r = min(runs, key=lambda run: run['wall_s'])
+        results['results'].append(r)
+
+        stages = ' '.join(f"{k}={v['total_s']:.2f}s" for k, v in r['stages'].items() if k in STAGES)
+        print(f"{size:>4} photos -> {r['pages']:>3} pages  wall={r['wall_s']:.2f}s  {stages}"
+              f"  rss={r['peak_rss_mb']:.0f}MB  images={r['image_allocations']}"
+              f"  dupes={r['duplicates_dropped']}/{r['planted_duplicates']}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
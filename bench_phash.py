@@ -0,0 +1,83 @@
+"""
+Microbenchmark: imagehash.phash one image at a time vs ImageService.phash_batch,
+plus Python-loop vs vectorized Hamming distance matrices.
+
+    python bench_phash.py [--sizes 10,100,1000] [--json]
+"""
+import argparse
+import json
+import time
+
+import imagehash
+import numpy as np
+from PIL import Image
+
+from hash_index import hamming, hamming_matrix
+from image_service import ImageService
+
+
+def make_thumbnails(n, seed=0):
+    # Thumbnail-sized inputs, like the ones PhotoMetaCache keeps
+    rng = np.random.default_rng(seed)
+    return [
+        Image.fromarray(rng.integers(0, 256, (96, 128, 3), dtype=np.uint8))
+        for _ in range(n)
+    ]
+
+
+def best_of(fn, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(sizes):
+    svc = ImageService()
+    results = []
+    for n in sizes:
+        images = make_thumbnails(n)
+
+        t_single, single = best_of(lambda: [int(str(imagehash.phash(im)), 16) for im in images])
+        t_batch, batch = best_of(lambda: svc.phash_batch(images))
+        assert [int(h) for h in batch] == single, "phash_batch is not bit-compatible"
+
+        t_loop, loop = best_of(lambda: [[hamming(a, b) for b in single] for a in single], repeat=1)
+        t_matrix, matrix = best_of(lambda: hamming_matrix(batch))
+        assert matrix.tolist() == loop
+
+        results.append({
+            'images': n,
+            'phash_single_s': t_single,
+            'phash_batch_s': t_batch,
+            'phash_speedup': t_single / t_batch,
+            'hamming_loop_s': t_loop,
+            'hamming_matrix_s': t_matrix,
+            'hamming_speedup': t_loop / t_matrix,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--json', action='store_true', help='print raw JSON instead of a table')
+    args = parser.parse_args()
+
+    results = run([int(s) for s in args.sizes.split(',')])
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'images':>7} {'phash 1-by-1':>13} {'phash batch':>12} {'x':>6} {'hamming loop':>13} {'matrix':>9} {'x':>7}")
+    for r in results:
+        print(f"{r['images']:>7} {r['phash_single_s']:>12.4f}s {r['phash_batch_s']:>11.4f}s {r['phash_speedup']:>5.1f}x"
+              f" {r['hamming_loop_s']:>12.4f}s {r['hamming_matrix_s']:>8.4f}s {r['hamming_speedup']:>6.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+
+import metrics
+
+bytes_reclaimed = metrics.REGISTRY.counter('disk_bytes_reclaimed_total', 'Bytes deleted by the disk sweeper.')
+
+
+def _remove(path):
+    """Deletes a file and returns its size (0 if it was already gone)."""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        print(f"Error deleting {path}: {e}")
+        return 0
+
+
+def _page_id(filename):
+    # <uuid>.jpg, <uuid>_preview.jpg and <uuid>.webp are one page
+    return os.path.splitext(filename)[0].split('_')[0]
+
+
+class DiskSweeper:
+    """
+    Keeps tmp/ uploads and rendered pages from filling the disk:
+    - uploads are released as soon as their album is done (or the session is dropped),
+      and orphans older than upload_ttl are swept
+    - rendered pages expire after output_ttl
+    - if outputs exceed quota_bytes, least recently served pages go first
+    Runs as a low-priority background thread.
+    """
+
+    def __init__(self, upload_dir, output_dir, upload_ttl=24 * 3600, output_ttl=14 * 24 * 3600,
+                 quota_bytes=1024 * 1024 * 1024, interval=300, on_sweep=None):
+        self.upload_dir = upload_dir
+        self.output_dir = output_dir
+        self.upload_ttl = upload_ttl
+        self.output_ttl = output_ttl
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self.on_sweep = on_sweep  # hook run first on every sweep (e.g. expire idle sessions)
+        self.output_bytes = 0
+        self._last_served = {}  # page id -> time
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def release(self, paths, reason='album_done'):
+        """Deletes uploads that are no longer needed."""
+        freed = sum(_remove(p) for p in paths)
+        if freed:
+            bytes_reclaimed.inc(freed, reason=reason)
+        return freed
+
+    def touch(self, filename):
+        """Marks a page as recently served (for quota eviction)."""
+        with self._lock:
+            self._last_served[_page_id(filename)] = time.time()
+
+    def _scan(self, directory):
+        entries = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_file():
+                        st = entry.stat()
+                        entries.append((entry.path, entry.name, st.st_size, st.st_mtime))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def sweep(self):
+        """One pass over both directories. Returns {reason: bytes_freed}."""
+        if self.on_sweep is not None:
+            try:
+                self.on_sweep()
+            except Exception as e:
+                print(f"Error in sweep hook: {e}")
+
+        now = time.time()
+        freed = {'upload_ttl': 0, 'output_ttl': 0, 'quota': 0}
+
+        # 1. Orphaned uploads (crashed jobs, other workers' abandoned sessions)
+        for path, _, _, mtime in self._scan(self.upload_dir):
+            if now - mtime > self.upload_ttl:
+                freed['upload_ttl'] += _remove(path)
+
+        # 2. Expired pages, grouped so all renditions of a page go together
+        pages = {}
+        for path, name, size, mtime in self._scan(self.output_dir):
+            page = pages.setdefault(_page_id(name), {'paths': [], 'size': 0, 'mtime': mtime})
+            page['paths'].append(path)
+            page['size'] += size
+            page['mtime'] = max(page['mtime'], mtime)
+
+        for page_id in list(pages):
+            if now - pages[page_id]['mtime'] > self.output_ttl:
+                freed['output_ttl'] += sum(_remove(p) for p in pages.pop(page_id)['paths'])
+
+        # 3. Quota: evict least recently served (or created) pages
+        total = sum(page['size'] for page in pages.values())
+        if total > self.quota_bytes:
+            with self._lock:
+                last_used = {pid: max(page['mtime'], self._last_served.get(pid, 0)) for pid, page in pages.items()}
+            for page_id in sorted(pages, key=last_used.get):
+                if total <= self.quota_bytes:
+                    break
+                freed['quota'] += sum(_remove(p) for p in pages[page_id]['paths'])
+                total -= pages.pop(page_id)['size']
+
+        with self._lock:
+            self._last_served = {pid: t for pid, t in self._last_served.items() if pid in pages}
+        self.output_bytes = total
+
+        for reason, n in freed.items():
+            if n:
+                bytes_reclaimed.inc(n, reason=reason)
+        if any(freed.values()):
+            print(f"Disk sweep reclaimed {sum(freed.values()) / 1024 / 1024:.1f} MB {freed}")
+        return freed
+
+    def _run(self):
+        try:
+            # Lowest CPU priority for this thread only (Linux: threads have their own nice value)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping disk: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Starts the sweeper thread (once per process)."""
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="disk-sweeper", daemon=True)
+            self._thread.start()
@@ -1,38 +1,203 @@
 import os
-import google.generativeai as genai
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import json
 
+import metrics
+import photo_score
+from ratelimit import CircuitBreaker, TokenBucket
+from ttl_cache import TTLCache
+
+captions_total = metrics.REGISTRY.counter('gemini_captions_total', 'Caption requests by outcome (hit, ok, timeout, error, busy, rate_limited, circuit_open, disabled).')
+picks_total = metrics.REGISTRY.counter('gemini_photo_picks_total', 'Gemini best-photo picks by outcome (same outcomes as captions).')
+
+
+def _caption_key(location, date):
+    # "渋谷, 2024夏" and " 渋谷 ,２０２４夏" are the same album as far as captions go
+    norm = lambda s: ' '.join(unicodedata.normalize('NFKC', s).lower().split())
+    return (norm(location), norm(date))
+
+
 class GeminiService:
-    def __init__(self):
+    def __init__(self, model=None):
+        """
+        model: anything with generate_content(contents, request_options=...) -> obj.text; defaults to
+        Gemini when GEMINI_API_KEY is set (pass a fake one for local testing).
+        The Gemini SDK is only imported when the model is first needed.
+        """
+        self._model = model
+        self._model_ready = model is not None
+        self._model_lock = threading.Lock()
+        if model is None and not os.getenv("GEMINI_API_KEY"):
+            print("Warning: GEMINI_API_KEY not found in env")
+
+        # Gemini calls are rate limited to our quota and never allowed to hold up
+        # an album for longer than the latency budget; captions are cached per (location, date)
+        self.timeout = float(os.getenv('GEMINI_TIMEOUT', 8))
+        # Hard limit per API request: past the budget a late caption can still be
+        # cached, but a hung request gives its slot back
+        self.request_timeout = self.timeout * 3
+        self.concurrency = int(os.getenv('GEMINI_CONCURRENCY', 4))
+        self._captions = TTLCache(max_entries=1000, ttl=int(os.getenv('CAPTION_CACHE_HOURS', 24)) * 3600)
+        self._bucket = TokenBucket(rate=float(os.getenv('GEMINI_RPM', 15)) / 60, capacity=self.concurrency)
+        self._breaker = CircuitBreaker(failure_threshold=5, reset_timeout=60)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="gemini")
+
+    @property
+    def model(self):
+        if not self._model_ready:
+            with self._model_lock:
+                if not self._model_ready:
+                    self._model = self._create_model()
+                    self._model_ready = True
+        return self._model
+
+    def _create_model(self):
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
-            print("Warning: GEMINI_API_KEY not found in env")
+            return None
+        import google.generativeai as genai # ~1 s of imports; see warmup()
+        endpoint = os.getenv("GEMINI_API_ENDPOINT") # e.g. a local fake (loadtest.py)
+        if endpoint:
+            genai.configure(api_key=api_key, transport='rest', client_options={'api_endpoint': endpoint})
         else:
             genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+        return genai.GenerativeModel('gemini-1.5-flash')
 
-    def select_best_photos(self, image_paths, max_count=5):
+    def warmup(self):
         """
-        Uploads images to Gemini and asks for the best ones.
-        Returns a list of indices.
+        Imports the Gemini SDK ahead of the first album. Doesn't create the
+        client, so it's safe to run before gunicorn forks its workers.
+        """
+        if not self._model_ready and os.getenv("GEMINI_API_KEY"):
+            import google.generativeai # noqa: F401
+
+    def select_best_photos(self, image_paths, max_count=5, scores=None, thumbnails=None, top_k=0):
+        """
+        Picks the best max_count photos. Returns a list of indices, in album order.
+        Ranking is local (photo_score scores); with top_k and thumbnails, only
+        the top_k candidates are shown to Gemini, which makes the final pick.
         """
-        # In a real scenario, we'd upload bytes. here we mock or assume local paths.
-        # Since LINE sends bytes, we might need to save them temp or send bytes directly.
-        # For this prototype, we'll assume we saved them to tmp/ and have paths.
-        
         # Cost optimization: If < max_count, return all.
         if len(image_paths) <= max_count:
             return list(range(len(image_paths)))
+        if scores is None:
+            # Nothing to rank by: keep the first n
+            return list(range(max_count))
+
+        best = photo_score.top_indices(scores, max_count)
+        if not top_k or thumbnails is None:
+            return best
 
-        # TODO: Implement actual Gemini Vision call
-        # For now, return the first n images to save tokens/complexity in this step
-        return list(range(max_count))
+        candidates = photo_score.top_indices(scores, max(top_k, max_count))
+        outcome = self._call_gemini(self._call_pick, [thumbnails[i] for i in candidates], max_count)
+        picks_total.inc(result=outcome if isinstance(outcome, str) else 'ok')
+        if isinstance(outcome, str):
+            return best
+        # Gemini's choice, topped up from the local ranking if it returned too few
+        picked = [candidates[i] for i in outcome]
+        for i in sorted(candidates, key=lambda i: -scores[i]):
+            if len(picked) >= max_count:
+                break
+            if i not in picked:
+                picked.append(i)
+        return sorted(picked)
+
+    def _call_pick(self, thumbnails, max_count):
+        prompt = f"""
+        These {len(thumbnails)} photos (numbered 0 to {len(thumbnails) - 1} in the order given) are from one trip.
+        Pick the {max_count} best for a memory album: sharp, well exposed, people smiling, and varied scenes.
+
+        Output Format (JSON): a list of {max_count} photo numbers, e.g. [0, 3, 4]
+        """
+        chosen = json.loads(self._strip_markdown(self._generate([prompt, *thumbnails]).text))
+        picked = []
+        for i in chosen:
+            if isinstance(i, int) and 0 <= i < len(thumbnails) and i not in picked:
+                picked.append(i)
+        return picked[:max_count]
 
     def generate_captions(self, location, date, image_descriptions=[]):
         """
         Generates a Gyaru-style title and caption.
+        Falls back to a stock caption (immediately, or after the GEMINI_TIMEOUT budget)
+        when Gemini is slow, failing, over quota or not configured.
         """
-        prompt = f"""
+        key = _caption_key(location, date)
+        cached = self._captions.get(key)
+        if cached is not None:
+            captions_total.inc(result='hit')
+            return dict(cached)
+
+        outcome = self._call_gemini(self._call_captions, key, location, date)
+        captions_total.inc(result=outcome if isinstance(outcome, str) else 'ok')
+        if isinstance(outcome, str):
+            return self._fallback_captions(location)
+        return dict(outcome)
+
+    def _call_gemini(self, func, *args):
+        """
+        Runs func(*args) (a model call) within our quota, concurrency limit,
+        latency budget and circuit breaker. Returns its result, or the reason
+        (a string) there is none.
+        """
+        if self.model is None:
+            return 'disabled'
+        # One budget for the whole call: waiting for a slot, a token and the answer
+        deadline = time.monotonic() + self.timeout
+        if not self._breaker.allow():
+            return 'circuit_open'
+        # Every in-flight call holds a slot until Gemini answers, even past our budget,
+        # so a hanging API can't pile up threads
+        if not self._slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            self._breaker.cancel()  # Saturated locally; Gemini may just be slow, not failing
+            return 'busy'
+        if not self._bucket.acquire(timeout=max(0, deadline - time.monotonic())):
+            self._slots.release()
+            self._breaker.cancel()  # Not the API's fault
+            return 'rate_limited'
+        late = []  # set once we've given up waiting; the call has then already counted as failed
+        future = self._pool.submit(self._guarded, late, func, *args)
+        try:
+            return future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeout:
+            # Over budget counts against the breaker, so a hanging API soon gets
+            # the fast fallback. The call keeps running; a late caption still lands in the cache
+            late.append(True)
+            self._breaker.record_failure()
+            print(f"Gemini over {self.timeout}s budget, using fallback")
+            return 'timeout'
+        except Exception as e:
+            print(f"Error calling Gemini ({func.__name__}): {e}")
+            return 'error'
+
+    def _guarded(self, late, func, *args):
+        try:
+            result = func(*args)
+        except Exception:
+            if not late:
+                self._breaker.record_failure()
+            raise
+        else:
+            if not late:
+                self._breaker.record_success()
+            return result
+        finally:
+            self._slots.release()
+
+    def _generate(self, contents):
+        return self.model.generate_content(contents, request_options={'timeout': self.request_timeout})
+
+    def _call_captions(self, key, location, date):
+        captions = self._parse_captions(self._generate(self._caption_prompt(location, date)).text)
+        self._captions.set(key, captions)
+        return captions
+
+    def _caption_prompt(self, location, date):
+        return f"""
         You are a high-energy, trendy Japanese Gyaru (Gal) from Shibuya.
         Current Year: 2024 (or {date})
         
@@ -48,17 +213,18 @@ class GeminiService:
             "comment": "1-2 sentences in heavy Gyaru-go (uses terms like わかりみ, きゃわ, あげぽよ, etc.)"
         }}
         """
-        
-        try:
-            response = self.model.generate_content(prompt)
-            text = response.text.strip()
-            # Clean up json markdown
-            if text.startswith("```json"):
-                text = text[7:-3]
-            elif text.startswith("```"):
-                text = text[3:-3]
-            return json.loads(text)
-        except Exception as e:
-            print(f"Error generating caption: {e}")
-            return {"title": "Travel Memoz", "location_romaji": location, "comment": "超楽しかったー！マジ最高！"}
 
+    def _strip_markdown(self, text):
+        text = text.strip()
+        # Clean up json markdown
+        if text.startswith("```json"):
+            text = text[7:-3]
+        elif text.startswith("```"):
+            text = text[3:-3]
+        return text
+
+    def _parse_captions(self, text):
+        return json.loads(self._strip_markdown(text))
+
+    def _fallback_captions(self, location):
+        return {"title": "Travel Memoz", "location_romaji": location, "comment": "超楽しかったー！マジ最高！"}
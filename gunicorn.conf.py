@@ -0,0 +1,42 @@
+"""
+Gunicorn settings (gunicorn reads ./gunicorn.conf.py automatically).
+
+The app is imported and warmed once in the master (preload_app), then the
+workers are forked from it and share those pages copy-on-write, so each
+worker starts in milliseconds and doesn't pay for its own copy.
+Background threads are started per worker, after the fork.
+"""
+import os
+import time
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_WORKERS', 1))
+threads = int(os.getenv('WEB_THREADS', 8))
+preload_app = True
+
+
+def on_starting(server):
+    # Sessions in process memory would be split between workers: a user's
+    # photos would land in whichever worker took each webhook
+    if server.cfg.workers > 1 and os.getenv('SESSION_STORE', 'memory') == 'memory':
+        raise RuntimeError(
+            f"{server.cfg.workers} workers need a shared session store: set SESSION_STORE=sqlite "
+            "(or run a single worker)"
+        )
+
+
+def when_ready(server):
+    # Master, app already imported (preload), before any worker is forked
+    import app
+    app.warmup()
+    app.report_startup()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    import app
+    app.start_background()
+    print(f"Worker {worker.pid} ready {time.perf_counter() - worker.forked_at:.3f}s after fork")
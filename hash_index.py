@@ -0,0 +1,107 @@
+try:
+    _popcount = int.bit_count # Python 3.10+
+except AttributeError:
+    def _popcount(x):
+        return bin(x).count("1")
+
+
+def hamming(a, b):
+    """Number of differing bits between two integer hashes."""
+    return _popcount(a ^ b)
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over fixed-width integer hashes (e.g. 64-bit phashes).
+    The hash is split into radius + 1 disjoint chunks, one exact-match table
+    per chunk. Two hashes within `radius` bits must agree exactly on at least
+    one chunk (pigeonhole), so a query only checks entries sharing a chunk.
+    (A BK-tree degrades to a near-full scan at radius ~9 of 64 bits.)
+    """
+
+    def __init__(self, radius, bits=64):
+        self.radius = radius
+        self.bits = bits
+        chunks = min(radius + 1, bits)
+        self._slices = []
+        for k in range(chunks):
+            lo = bits * k // chunks
+            hi = bits * (k + 1) // chunks
+            self._slices.append((lo, (1 << (hi - lo)) - 1))
+        self._tables = [{} for _ in self._slices]
+        self._hashes = {}  # item -> hash
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _keys(self, h):
+        return [(h >> lo) & mask for lo, mask in self._slices]
+
+    def add(self, h, item):
+        self._hashes[item] = h
+        for table, key in zip(self._tables, self._keys(h)):
+            table.setdefault(key, []).append(item)
+
+    def search(self, h, radius=None):
+        """Returns [(distance, item), ...] for every entry within radius bits."""
+        if radius is None or radius > self.radius:
+            radius = self.radius
+        candidates = set()
+        for table, key in zip(self._tables, self._keys(h)):
+            bucket = table.get(key)
+            if bucket:
+                candidates.update(bucket)
+        found = []
+        for item in candidates:
+            d = hamming(h, self._hashes[item])
+            if d <= radius:
+                found.append((d, item))
+        return found
+
+
+def cluster_hashes(hashes, cutoff):
+    """
+    Groups near-duplicate hashes (distance < cutoff).
+    Greedy leader clustering in input order: each hash joins the earliest
+    leader it is close to, otherwise it leads a new cluster. This is exactly
+    what the old pairwise "compare with every kept hash" loop did.
+    None entries (unhashable images) always get their own cluster.
+    Returns a list of clusters, each a list of indices with the leader first.
+    """
+    index = MultiIndexHash(radius=cutoff - 1)
+    clusters = []
+    cluster_of_leader = {}
+    for i, h in enumerate(hashes):
+        if h is None:
+            clusters.append([i])
+            continue
+        matches = index.search(h)
+        if matches:
+            leader = min(item for _, item in matches)
+            clusters[cluster_of_leader[leader]].append(i)
+        else:
+            cluster_of_leader[i] = len(clusters)
+            clusters.append([i])
+            index.add(h, i)
+    return clusters
+
+
+# Byte popcount table for NumPy < 2.0 (no np.bitwise_count)
+_BYTE_POPCOUNT = None
+
+def hamming_matrix(a, b=None):
+    """
+    Pairwise Hamming distances between two uint64 hash arrays (vectorized
+    XOR + popcount). Returns an (len(a), len(b)) uint8 matrix; b defaults to a.
+    """
+    global _BYTE_POPCOUNT
+    import numpy as np
+
+    a = np.asarray(a, dtype=np.uint64)
+    b = a if b is None else np.asarray(b, dtype=np.uint64)
+    x = a[:, None] ^ b[None, :]
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    if _BYTE_POPCOUNT is None:
+        _BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return _BYTE_POPCOUNT[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.uint8)
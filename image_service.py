@@ -23,15 +23,167 @@ import random
 from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageFilter
 import math
 import os
-import imagehash
+import functools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from hash_index import cluster_hashes
+from photo_meta import PhotoMetaCache
+import photo_score
+import metrics
+
+# Process-wide font/text caches, shared by every ImageService.
+# FreeType faces aren't thread-safe, so fonts are only used under the lock.
+_font_cache = {} # (path, size) -> font (or the default font if loading failed)
+_text_cache = OrderedDict() # (path, size, text, anchor) -> (mask, offset), LRU
+_text_cache_size = 256
+_font_lock = threading.Lock()
+
+def _get_font(path, size):
+    font = _font_cache.get((path, size))
+    if font is None:
+        try:
+            font = ImageFont.truetype(path, size)
+        except Exception as e:
+            print(f"Error loading font {path} ({size}px), using default: {e}")
+            font = ImageFont.load_default()
+        _font_cache[(path, size)] = font
+    return font
+
+# Sprite atlases, built once per process per (frame size, tape colors)
+_atlas_cache = {}
+_atlas_lock = threading.Lock()
+
+class SpriteAtlas:
+    """
+    Pre-rendered polaroid pieces for every rotation angle the layout uses:
+    the blurred shadow + white frame, the mask of the photo window and
+    where it sits, and the tape strips per color. Placing a photo is then
+    one resize, one rotate of the photo itself and two pastes.
+    """
+    photo_angles = range(-12, 13)
+    tape_angles = range(-17, 18) # photo angle +- 5
+    tape_size = (180, 45)
+
+    def __init__(self, pol_width, pol_height, tape_colors):
+        photo_side = pol_width - 40
+
+        # Shadow (blurred once) with the blank polaroid on top
+        shadow = Image.new('RGBA', (pol_width+40, pol_height+40), (0,0,0,0))
+        s_draw = ImageDraw.Draw(shadow)
+        s_draw.rectangle((20,20,pol_width+10,pol_height+10), fill=(0,0,0,60))
+        shadow = shadow.filter(ImageFilter.GaussianBlur(10))
+        shadow.paste((255,255,255,255), (10, 10, 10+pol_width, 10+pol_height))
+
+        window = Image.new('L', (photo_side, photo_side), 255)
+        # Photo window center relative to the frame center (photo sits at (30, 30))
+        dx = 30 + photo_side / 2 - shadow.width / 2
+        dy = 30 + photo_side / 2 - shadow.height / 2
+
+        self.frames = {}
+        self.windows = {}
+        for angle in self.photo_angles:
+            frame = shadow.rotate(angle, expand=True, resample=Image.BICUBIC)
+            mask = window.rotate(angle, expand=True, resample=Image.BICUBIC)
+            # PIL rotates counter-clockwise on screen (y axis points down)
+            rad = math.radians(angle)
+            rx = dx * math.cos(rad) + dy * math.sin(rad)
+            ry = -dx * math.sin(rad) + dy * math.cos(rad)
+            offset = (round(frame.width / 2 + rx - mask.width / 2),
+                      round(frame.height / 2 + ry - mask.height / 2))
+            self.frames[angle] = frame
+            self.windows[angle] = (mask, offset)
+
+        self.tapes = {}
+        for color in tape_colors:
+            tape = Image.new('RGBA', self.tape_size, color)
+            for angle in self.tape_angles:
+                self.tapes[(color, angle)] = tape.rotate(angle, expand=True, resample=Image.BICUBIC)
+
+def _get_sprite_atlas(pol_width, pol_height, tape_colors):
+    key = (pol_width, pol_height, tuple(tape_colors))
+    with _atlas_lock:
+        atlas = _atlas_cache.get(key)
+        if atlas is None:
+            atlas = _atlas_cache[key] = SpriteAtlas(pol_width, pol_height, tape_colors)
+        return atlas
+
+@functools.lru_cache(maxsize=256)
+def _detect_season(date_str):
+    date_str = str(date_str)
+    season = "spring" # default
+    if "夏" in date_str or "8" in date_str or "7" in date_str: season = "summer"
+    if "秋" in date_str or "9" in date_str or "10" in date_str or "11" in date_str: season = "autumn"
+    if "冬" in date_str or "12" in date_str or "1" in date_str or "2" in date_str: season = "winter"
+    return season
+
+# Pre-rendered seasonal backgrounds, built per season on first use:
+# (season, bg_color, size) -> [variant, ...]. Kept in palette mode (a page
+# has only a few flat colors), ~2 MB each instead of ~6 MB as RGB.
+_bg_cache = {}
+_bg_lock = threading.Lock()
+
+# Per-process service used by the page render pool (see _render_page_in_worker)
+_worker_svc = None
+
+def _init_render_worker(resize_threads):
+    global _worker_svc
+    _worker_svc = ImageService(render_processes=0, resize_threads=resize_threads)
+    # Nothing is shared with the parent (forkserver/spawn), so only build what
+    # rendering needs: never scipy (workers don't hash); backgrounds and fonts on first use
+    _worker_svc.sprites
+
+def _render_page_in_worker(args):
+    # Stage timings are handed back so the parent can record them
+    trace = metrics.start_trace()
+    try:
+        return _worker_svc._render_page(*args), trace.stages
+    finally:
+        metrics.end_trace()
+
+# Part of every album cache key: bump when a change alters rendered pages,
+# so albums cached by an older version are rendered afresh
+LAYOUT_VERSION = 1
 
 class ImageService:
-    def __init__(self):
+    def __init__(self, render_processes=None, resize_threads=None):
         self.font_path = "static/fonts/Yomogi-Regular.ttf"
         if not os.path.exists(self.font_path):
             self.font_path = "static/fonts/default.ttf" 
+
+        # Parallelism (0/1 = serial). Pages go to a process pool, photos within
+        # a page are resized on threads (Pillow releases the GIL while resizing).
+        if render_processes is None:
+            render_processes = int(os.getenv("RENDER_PROCESSES", 0))
+        if resize_threads is None:
+            resize_threads = int(os.getenv("RESIZE_THREADS", 1))
+        self.render_processes = render_processes
+        self.resize_threads = resize_threads
+
+        self.page_size = (1080, 1920)
+        self.pol_width = 480
+        self.pol_height = 580
+        self.photo_side = 440 # Polaroid photo window (pol_width - 40)
+        self.thumb_side = 128 # Cached per-photo thumbnail (also the phash source)
+
+        # Uploads are stored once, upright and downscaled (see canonicalize)
+        self.upload_max_side = int(os.getenv("UPLOAD_MAX_SIDE", 1024))
+        self.upload_format = "WEBP" if os.getenv("UPLOAD_FORMAT", "jpeg").lower() == "webp" else "JPEG"
+        self.upload_ext = "webp" if self.upload_format == "WEBP" else "jpg"
+
+        # Output renditions
+        self.preview_max_side = int(os.getenv("PREVIEW_MAX_SIDE", 480))
+        self.write_webp = os.getenv("ALBUM_WEBP", "0") == "1"
+
+        # Per-photo metadata, filled in as uploads arrive (see describe_image)
+        self.meta = PhotoMetaCache(self.describe_image)
+        self._render_pool = None
+        self._resize_pool = None
             
         self.bg_color = (248, 245, 240) # Warm Off-white
+        self.bg_pool_size = 3 # Pre-rendered background variants per season
         self.tape_colors = [
             (255, 182, 193, 220), # Pink
             (173, 216, 230, 220), # Blue
@@ -40,59 +192,237 @@ class ImageService:
             (230, 230, 250, 220)  # Lavender
         ]
 
-    def load_image(self, image_path):
-        return Image.open(image_path)
+    @property
+    def sprites(self):
+        # Frames, shadows and tape for every angle, built once per process (on first use)
+        return _get_sprite_atlas(self.pol_width, self.pol_height, self.tape_colors)
+
+    def warmup(self):
+        """
+        Builds the per-process caches every album needs (fonts, sprite atlas)
+        and imports scipy. Construction stays cheap; call this once before
+        forking workers (gunicorn preload) so they all share the result, or
+        let the first album pay for it. Seasonal backgrounds aren't included:
+        each season's are built (in a few ms) by its first album.
+        """
+        import scipy.fftpack # noqa: F401
+        # The sizes every album uses (title, romaji, date)
+        with _font_lock:
+            for size in (100, 70, 50):
+                _get_font(self.font_path, size)
+        self.sprites
+
+    def load_image(self, image_path, target_side=None):
+        """
+        Decodes an image upright (EXIF orientation applied) and in RGB.
+        With target_side, only decodes as much resolution as a target_side
+        square crop needs: JPEGs use libjpeg's DCT scaling via draft(), other
+        formats are box-reduced right after decoding.
+        """
+        with Image.open(image_path) as img:
+            if target_side:
+                img.draft("RGB", (target_side, target_side))
+            img = ImageOps.exif_transpose(img)
+
+        if target_side:
+            factor = min(img.size) // target_side
+            if factor >= 2:
+                img = img.reduce(factor)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return img
+
+    def canonicalize(self, source, dest):
+        """
+        Stores an upload in the form every later stage works from: upright,
+        RGB, at most upload_max_side px, encoded as upload_format (upload_ext
+        is its extension). Nothing downstream needs more resolution, so the
+        original is never decoded at full size again. source is a path or a
+        file object.
+        """
+        with Image.open(source) as img:
+            img.draft("RGB", (self.upload_max_side, self.upload_max_side))
+            img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((self.upload_max_side, self.upload_max_side), Image.LANCZOS, reducing_gap=2.0)
+        if self.upload_format == "WEBP":
+            img.save(dest, "WEBP", quality=85, method=4)
+        else:
+            img.save(dest, "JPEG", quality=90)
+        return img.size
+
+    def _get_render_pool(self):
+        if self._render_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            # Don't fork a process that is running webhook/worker threads
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._render_pool = ProcessPoolExecutor(
+                max_workers=self.render_processes,
+                mp_context=ctx,
+                initializer=_init_render_worker,
+                initargs=(self.resize_threads,),
+            )
+        return self._render_pool
+
+    def _get_resize_pool(self):
+        if self._resize_pool is None:
+            self._resize_pool = ThreadPoolExecutor(max_workers=self.resize_threads, thread_name_prefix="resize")
+        return self._resize_pool
+
+    def close(self):
+        """Shuts down the render/resize pools (if they were started)."""
+        if self._render_pool is not None:
+            self._render_pool.shutdown()
+            self._render_pool = None
+        if self._resize_pool is not None:
+            self._resize_pool.shutdown()
+            self._resize_pool = None
+
+    def describe_image(self, path):
+        """
+        Cheap per-photo metadata from one small decode: 64-bit phash (int),
+        upright size, EXIF orientation and a thumb_side thumbnail.
+        """
+        with Image.open(path) as img: # header only, no decode
+            width, height = img.size
+            orientation = img.getexif().get(0x0112, 1)
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+
+        thumb = self.load_image(path, target_side=self.thumb_side)
+        thumb.thumbnail((self.thumb_side, self.thumb_side))
+        return {
+            'phash': int(self.phash_batch([thumb])[0]),
+            'width': width,
+            'height': height,
+            'orientation': orientation,
+            'thumbnail': thumb,
+        }
+
+    def phash_batch(self, images):
+        """
+        Perceptual hashes for many images at once, bit-compatible with
+        imagehash.phash. The grayscale thumbnails are stacked into one array
+        so the DCTs and median thresholds run over the whole batch.
+        Returns a uint64 array of 64-bit hashes (feeds hash_index.hamming_matrix).
+        """
+        if not images:
+            return np.zeros(0, dtype=np.uint64)
+        import scipy.fftpack # Lazy: a large import, only needed once photos arrive
+        hash_size = 8
+        img_size = hash_size * 4 # imagehash's default highfreq_factor
+        pixels = np.stack([
+            np.asarray(im.convert('L').resize((img_size, img_size), Image.LANCZOS))
+            for im in images
+        ])
+        dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+        low = dct[:, :hash_size, :hash_size].reshape(len(images), -1)
+        bits = low > np.median(low, axis=1)[:, None]
+        # Row-major bits, first bit most significant (same as str(ImageHash))
+        packed = np.packbits(bits, axis=1)
+        return packed.view('>u8').ravel().astype(np.uint64)
+
+    def _hash_image(self, path):
+        """64-bit perceptual hash of an image as an int."""
+        return self.meta.get(path)['phash']
+
+    def score_photos(self, image_paths):
+        """
+        Quality score in [0, 1] per photo (photo_score: sharpness, exposure,
+        contrast, saturation, faces), from the cached thumbnails.
+        """
+        thumbs = []
+        for path in image_paths:
+            try:
+                thumbs.append(self.meta.get(path)['thumbnail'])
+            except Exception as e:
+                print(f"Error scoring {path}: {e}")
+                thumbs.append(Image.new('RGB', (8, 8))) # scores ~0: picked last
+        return photo_score.score_photos(thumbs)
+
+    def _photo_rank(self, path):
+        """Tie-breaker for picking which near-duplicate to keep: resolution (higher is better)."""
+        try:
+            meta = self.meta.get(path)
+            return meta['width'] * meta['height']
+        except Exception:
+            return 0
+
+    def find_duplicate_clusters(self, image_paths, cutoff=10):
+        """
+        Groups near-duplicate images (phash distance < cutoff).
+        Returns a list of clusters (lists of paths), in album order.
+        """
+        hashes = []
+        for p in image_paths:
+            try:
+                hashes.append(self._hash_image(p))
+            except Exception as e:
+                print(f"Error hashing {p}: {e}")
+                # If error, keep it safe (own cluster)
+                hashes.append(None)
+
+        return [[image_paths[i] for i in cluster] for cluster in cluster_hashes(hashes, cutoff)]
 
     def _deduplicate_images(self, image_paths, cutoff=10):
         """
         Removes similar images using ImageHash.
-        Returns a filtered list of paths (preserving best ones - currently just first).
+        Returns a filtered list of paths, keeping the best member of each
+        near-duplicate cluster (highest quality score, then resolution).
         """
         if not image_paths:
             return []
-            
-        hashes = {}
+
         unique_paths = []
-        
-        for p in image_paths:
-            try:
-                img = Image.open(p)
-                h = imagehash.phash(img)
-                duplicate = False
-                for existing_h in hashes:
-                    if h - existing_h < cutoff: # Hamming distance
-                        duplicate = True
-                        break
-                if not duplicate:
-                    hashes[h] = p
-                    unique_paths.append(p)
-            except Exception as e:
-                print(f"Error hashing {p}: {e}")
-                # If error, keep it safe
-                unique_paths.append(p)
-                
+        for cluster in self.find_duplicate_clusters(image_paths, cutoff):
+            if len(cluster) == 1:
+                unique_paths.append(cluster[0])
+            else:
+                # Uploads are all capped to the same size, so quality decides;
+                # resolution only breaks ties (max() keeps the earliest after that)
+                scores = self.score_photos(cluster)
+                best = max(range(len(cluster)), key=lambda i: (float(scores[i]), self._photo_rank(cluster[i])))
+                unique_paths.append(cluster[best])
         return unique_paths
 
-    def create_album_pages(self, image_paths, title=None, date=None, location_romaji=None):
+    def create_album_pages(self, image_paths, title=None, date=None, location_romaji=None, seed=None, select=None):
         """
         Creates a list of album images (pages).
+        Layout randomness comes from `seed`; the same seed gives the same pages
+        whether they are rendered serially or in the process pool.
+        `select(paths) -> paths` (optional) trims the photos after deduplication.
+        """
+        return list(self.iter_album_pages(image_paths, title, date, location_romaji, seed, select))
+
+    def iter_album_pages(self, image_paths, title=None, date=None, location_romaji=None, seed=None, select=None):
+        """
+        Generator version of create_album_pages: yields pages in order as soon
+        as each one is rendered, so callers can encode/send page 1 early.
         """
+        rng = random.Random(seed)
+
         # 1. Deduplicate
-        unique_paths = self._deduplicate_images(image_paths)
+        with metrics.timed('dedup'):
+            unique_paths = self._deduplicate_images(image_paths)
         print(f"Deduplicated: {len(image_paths)} -> {len(unique_paths)}")
-        
-        images = [self.load_image(p) for p in unique_paths]
-        pages = []
-        
+        metrics.duplicates_dropped.inc(len(image_paths) - len(unique_paths))
+
+        if select is not None:
+            with metrics.timed('select'):
+                selected = select(unique_paths)
+            print(f"Selected: {len(unique_paths)} -> {len(selected)}")
+            unique_paths = selected
+
         # 2. Dynamic Chunking (3-5 per page)
         chunks = []
-        remaining = images[:]
+        remaining = unique_paths[:]
         while remaining:
             # Decide size for this page
             if len(remaining) <= 5:
                 size = len(remaining)
             else:
-                size = random.randint(3, 5)
+                size = rng.randint(3, 5)
                 # Avoid leaving 1 or 2 images for last page if possible
                 if len(remaining) - size < 3 and len(remaining) - size > 0:
                      size = len(remaining) # Just take all if only small remainder
@@ -102,23 +432,76 @@ class ImageService:
             remaining = remaining[size:]
             chunks.append(chunk)
 
+        # Each page gets its own seed so pages can render in any order/process
+        jobs = []
         for i, chunk in enumerate(chunks):
             # Page Title (Only first page gets big title)
             page_title = title if i == 0 else None
             page_loc = location_romaji if i == 0 else None
-            
-            canvas = self._create_single_page(chunk, page_title, page_loc, date)
-            pages.append(canvas)
-            
-        return pages
+            jobs.append((chunk, page_title, page_loc, date, rng.getrandbits(64)))
+
+        if self.render_processes > 1 and len(jobs) > 1:
+            # map() submits every page up front and hands results back in order
+            for page, stages in self._get_render_pool().map(_render_page_in_worker, jobs):
+                for stage, (seconds, _) in stages.items():
+                    metrics.record(stage, seconds)
+                metrics.pages_produced.inc()
+                yield page
+        else:
+            for job in jobs:
+                page = self._render_page(*job)
+                metrics.pages_produced.inc()
+                yield page
+
+    def _render_page(self, paths, title, location_romaji, date, page_seed):
+        # Photos are decoded per page (and at slot resolution), never the whole album at once
+        with metrics.timed('decode'):
+            images = [self.load_image(p, target_side=self.photo_side) for p in paths]
+        with metrics.timed('render_page'):
+            return self._create_single_page(images, title, location_romaji, date, random.Random(page_seed))
 
-    def _create_single_page(self, images, title, location_romaji, date):
-        width, height = 1080, 1920
-        canvas = Image.new('RGB', (width, height), self.bg_color)
-        draw = ImageDraw.Draw(canvas)
+    def save_page(self, page, output_dir, name):
+        """
+        Encodes a rendered page into its delivery renditions and returns their
+        filenames: the original (optimized progressive JPEG), a small preview
+        for the chat thumbnail, and optionally a WebP copy.
+        """
+        files = {}
+        with metrics.timed('encode'):
+            files['original'] = f"{name}.jpg"
+            page.save(os.path.join(output_dir, files['original']), 'JPEG',
+                      quality=85, optimize=True, progressive=True)
+
+            # LINE shows previewImageUrl in the chat (max 1 MB); no need for 1080x1920
+            preview = page.copy()
+            preview.thumbnail((self.preview_max_side, self.preview_max_side), Image.BILINEAR)
+            files['preview'] = f"{name}_preview.jpg"
+            preview.save(os.path.join(output_dir, files['preview']), 'JPEG', quality=70, optimize=True)
+
+            if self.write_webp:
+                files['webp'] = f"{name}.webp"
+                page.save(os.path.join(output_dir, files['webp']), 'WEBP', quality=80, method=4)
+        return files
+
+    def _fit_photo(self, img, target_side):
+        """Resizes and center-crops a photo to a target_side square."""
+        img_ratio = img.width / img.height
+        
+        if img_ratio > 1:
+            new_h = target_side; new_w = int(new_h * img_ratio)
+        else:
+            new_w = target_side; new_h = int(new_w / img_ratio)
         
-        # Seasonal Background
-        self._draw_seasonal_bg(canvas, draw, date)
+        img = img.resize((new_w, new_h), Image.LANCZOS)
+        # Crop center
+        left = (img.width - target_side)//2
+        top = (img.height - target_side)//2
+        return img.crop((left, top, left+target_side, top+target_side))
+
+    def _create_single_page(self, images, title, location_romaji, date, rng):
+        width, height = self.page_size
+        # Seasonal Background (copy of a cached variant)
+        canvas = self._seasonal_background((width, height), date, rng)
 
         # Better Scatter Layout logic
         # Divide canvas into zones.
@@ -134,143 +517,152 @@ class ImageService:
         elif count >= 5:
             centers = [(250, 450), (830, 500), (540, 850), (300, 1250), (780, 1300)]
             
-        pol_width = 480
-        pol_height = 580
+        target_side = self.photo_side
 
-        for i, img in enumerate(images):
-            # Process Image (Resize/Crop/Frame/Shadow)
-            # ... (Reuse previous logic for aesthetics) ...
-            
-            # --- START COPIED LOGIC (Refactored for brevity) ---
-            img_ratio = img.width / img.height
-            target_side = pol_width - 40
-            
-            if img_ratio > 1:
-                new_h = target_side; new_w = int(new_h * img_ratio)
-            else:
-                new_w = target_side; new_h = int(new_w / img_ratio)
-            
-            img = img.resize((new_w, new_h), Image.LANCZOS)
-            # Crop center
-            left = (img.width - target_side)//2
-            top = (img.height - target_side)//2
-            img = img.crop((left, top, left+target_side, top+target_side))
-            
-            polaroid = Image.new('RGBA', (pol_width, pol_height), (255,255,255,255))
-            polaroid.paste(img, (20, 20))
-            
-            # Shadow
-            shadow = Image.new('RGBA', (pol_width+40, pol_height+40), (0,0,0,0))
-            s_draw = ImageDraw.Draw(shadow)
-            s_draw.rectangle((20,20,pol_width+10,pol_height+10), fill=(0,0,0,60))
-            shadow = shadow.filter(ImageFilter.GaussianBlur(10))
-            
-            combined = Image.new('RGBA', (pol_width+40, pol_height+40), (0,0,0,0))
-            combined.paste(shadow, (0,0))
-            combined.paste(polaroid, (10,10))
-            
-            angle = random.randint(-12, 12)
-            combined = combined.rotate(angle, expand=True, resample=Image.BICUBIC)
-            # --- END COPIED LOGIC ---
+        # Resize/crop up front (in parallel if enabled); deterministic, no rng use
+        if self.resize_threads > 1 and len(images) > 1:
+            photos = list(self._get_resize_pool().map(lambda im: self._fit_photo(im, target_side), images))
+        else:
+            photos = [self._fit_photo(im, target_side) for im in images]
+
+        for i, img in enumerate(photos):
+            # Frame + blurred shadow come pre-rotated from the sprite atlas;
+            # only the photo itself is rotated here
+            angle = rng.randint(-12, 12)
+            frame = self.sprites.frames[angle]
+            window, (wx, wy) = self.sprites.windows[angle]
 
             # Position
             if i < len(centers):
                 cx, cy = centers[i]
                 # Add randomness
-                cx += random.randint(-40, 40)
-                cy += random.randint(-40, 40)
+                cx += rng.randint(-40, 40)
+                cy += rng.randint(-40, 40)
                 
                 # Center-anchor paste
-                paste_x = cx - combined.width//2
-                paste_y = cy - combined.height//2
+                paste_x = cx - frame.width//2
+                paste_y = cy - frame.height//2
                 
-                canvas.paste(combined, (paste_x, paste_y), combined)
+                canvas.paste(frame, (paste_x, paste_y), frame)
+                photo = img.rotate(angle, expand=True, resample=Image.BICUBIC)
+                canvas.paste(photo, (paste_x + wx, paste_y + wy), window)
                 
                 # Tape - adjusted calculation
                 # Tape should be at the "top" of the rotated photo
                 # Simplified: just paste tape at top center of bounding box with same rotation + 90
-                self._add_tape(canvas, cx, paste_y + 30, angle)
+                self._add_tape(canvas, cx, paste_y + 30, angle, rng)
 
         # Titles & Text
         if title:
             # Main Title (Gyaru)
-            self._draw_text(draw, title, (540, 150), font_size=100, color=(255, 105, 180), anchor="mm", shadow=True)
+            self._draw_text(canvas, title, (540, 150), font_size=100, color=(255, 105, 180), anchor="mm", shadow=True)
         
         if location_romaji:
             # Subtitle (Romaji - Stylized)
-            self._draw_text(draw, location_romaji, (540, 260), font_size=70, color=(100, 150, 200), anchor="mm")
+            self._draw_text(canvas, location_romaji, (540, 260), font_size=70, color=(100, 150, 200), anchor="mm")
             
         if date:
              # Footer
-             self._draw_text(draw, date, (900, 1800), font_size=50, color=(128, 128, 128), anchor="rb")
+             self._draw_text(canvas, date, (900, 1800), font_size=50, color=(128, 128, 128), anchor="rb")
 
         return canvas
 
-    def _draw_seasonal_bg(self, canvas, draw, date_str):
-        """Draws simple seasonal motifs based on date string."""
-        date_str = str(date_str)
-        season = "spring" # default
-        if "夏" in date_str or "8" in date_str or "7" in date_str: season = "summer"
-        if "秋" in date_str or "9" in date_str or "10" in date_str or "11" in date_str: season = "autumn"
-        if "冬" in date_str or "12" in date_str or "1" in date_str or "2" in date_str: season = "winter"
+    def _seasonal_background(self, size, date_str, rng=None):
+        """Returns a fresh page canvas: a copy of one of the season's cached backgrounds (rng picks which)."""
+        season = _detect_season(date_str)
+        key = (season, self.bg_color, size)
+        with _bg_lock:
+            variants = _bg_cache.get(key)
+            if variants is None:
+                # Fixed seeds, so every process (and the render pool) has the same variants
+                variants = []
+                for i in range(self.bg_pool_size):
+                    bg = self._render_seasonal_bg(size, season, random.Random(f"{season}:{i}"))
+                    if bg.getcolors(256) is not None: # Lossless as a palette image
+                        bg = bg.convert('P', palette=Image.ADAPTIVE)
+                    variants.append(bg)
+                _bg_cache[key] = variants
+        return (rng.choice(variants) if rng is not None else variants[0]).convert('RGB')
+
+    def _render_seasonal_bg(self, size, season, rng):
+        """Draws simple seasonal motifs, alpha-blended over the background color."""
+        base = Image.new('RGBA', size, self.bg_color)
+        overlay = Image.new('RGBA', size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
         
         # Draw motifs (simple circles/lines for now to keep it efficient)
-        w, h = canvas.size
+        w, h = size
         
         if season == "summer":
             # Sun/Circles
             for _ in range(10):
-                r = random.randint(30, 80)
-                x = random.randint(0, w)
-                y = random.randint(0, h)
+                r = rng.randint(30, 80)
+                x = rng.randint(0, w)
+                y = rng.randint(0, h)
                 draw.ellipse((x, y, x+r, y+r), fill=(255, 255, 0, 40), outline=None)
         elif season == "autumn":
             # Orange/Brown leaves (ovals)
             for _ in range(15):
-                r = random.randint(20, 60)
-                x = random.randint(0, w)
-                y = random.randint(0, h)
+                r = rng.randint(20, 60)
+                x = rng.randint(0, w)
+                y = rng.randint(0, h)
                 draw.ellipse((x, y, x+r, y+r//2), fill=(210, 105, 30, 40), outline=None)
         elif season == "winter":
             # Blue icy circles
             for _ in range(12):
-                r = random.randint(10, 50)
-                x = random.randint(0, w)
-                y = random.randint(0, h)
+                r = rng.randint(10, 50)
+                x = rng.randint(0, w)
+                y = rng.randint(0, h)
                 draw.ellipse((x, y, x+r, y+r), fill=(173, 216, 230, 50), outline=None)
         else: # Spring (Pink petals)
             for _ in range(20):
-                r = random.randint(10, 30)
-                x = random.randint(0, w)
-                y = random.randint(0, h)
+                r = rng.randint(10, 30)
+                x = rng.randint(0, w)
+                y = rng.randint(0, h)
                 draw.ellipse((x, y, x+r, y+r), fill=(255, 192, 203, 60), outline=None)
 
+        return Image.alpha_composite(base, overlay).convert('RGB')
 
-    def _add_tape(self, canvas, center_x, top_y, angle):
-        w, h = 180, 45
-        color = random.choice(self.tape_colors)
-        tape = Image.new('RGBA', (w, h), color)
+    def _add_tape(self, canvas, center_x, top_y, angle, rng):
+        color = rng.choice(self.tape_colors)
         
         # Tape texture (transparency noise)
         # skipped for speed
         
-        tape_angle = angle + random.randint(-5, 5) # Parallel to photo or slightly off
-        tape = tape.rotate(tape_angle, expand=True, resample=Image.BICUBIC)
+        tape_angle = angle + rng.randint(-5, 5) # Parallel to photo or slightly off
+        tape = self.sprites.tapes[(color, tape_angle)] # pre-rotated
         
         canvas.paste(tape, (center_x - tape.width//2, top_y), tape)
 
-    def _draw_text(self, draw, text, position, font_size=40, color=(0, 0, 0), shadow=False, anchor="lt"):
-        try:
-            font = ImageFont.truetype(self.font_path, font_size)
-        except:
-            font = ImageFont.load_default()
-            
+    def _text_mask(self, text, font_size, anchor):
+        """Cached coverage mask of rendered text, plus its offset from the anchor point."""
+        key = (self.font_path, font_size, text, anchor)
+        with _font_lock:
+            cached = _text_cache.get(key)
+            if cached is not None:
+                _text_cache.move_to_end(key)
+                return cached
+
+            font = _get_font(self.font_path, font_size)
+            x0, y0, x1, y1 = font.getbbox(text, anchor=anchor)
+            mask = Image.new('L', (max(x1 - x0, 1), max(y1 - y0, 1)), 0)
+            ImageDraw.Draw(mask).text((-x0, -y0), text, font=font, fill=255, anchor=anchor)
+
+            _text_cache[key] = (mask, (x0, y0))
+            while len(_text_cache) > _text_cache_size:
+                _text_cache.popitem(last=False)
+            return mask, (x0, y0)
+
+    def _draw_text(self, canvas, text, position, font_size=40, color=(0, 0, 0), shadow=False, anchor="lt"):
+        mask, (ox, oy) = self._text_mask(text, font_size, anchor)
+        x, y = position
+        w, h = mask.size
+
         if shadow:
-            # Draw offsets
-            x, y = position
-            draw.text((x+5, y+5), text, font=font, fill=(50,50,50,50), anchor=anchor)
-        
-        draw.text(position, text, font=font, fill=color, anchor=anchor)
+            # Draw offsets (the RGB canvas ignores alpha, so this is solid grey)
+            canvas.paste((50, 50, 50), (x+5+ox, y+5+oy, x+5+ox+w, y+5+oy+h), mask)
+
+        canvas.paste(color[:3], (x+ox, y+oy, x+ox+w, y+oy+h), mask)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+downloads_failed = metrics.REGISTRY.counter('album_downloads_failed_total', 'Photo downloads from LINE that failed.')
+uploads_by_format = metrics.REGISTRY.counter('album_uploads_total', 'Downloaded photos, by format detected from their content.')
+upload_bytes = metrics.REGISTRY.counter('album_upload_bytes_total', 'Bytes of photos downloaded (raw) and kept on disk (stored).')
+
+
+def sniff_format(head):
+    """Image format from the first bytes of a file ('jpeg', 'png', ...), or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return 'heic'
+    return None
+
+
+class ImageIngest:
+    """
+    Downloads users' photos from the LINE content API in the background, so
+    the webhook only has to record the destination path and return.
+
+    - one pooled keep-alive session (the SDK opens a new connection per call)
+    - at most `workers` downloads at once
+    - bodies streamed to <path>.part in large chunks, renamed into place when
+      complete, so a finished file is never partial
+    - with a transform (e.g. ImageService.canonicalize), the body is kept in
+      memory and only transform's output is written: transform(fileobj, dest)
+      must write the final file to dest. Bodies that aren't images are
+      rejected before decoding.
+    """
+
+    def __init__(self, token, endpoint='https://api-data.line.me', workers=4,
+                 chunk_size=1024 * 1024, timeout=(5, 60), transform=None, on_done=None):
+        self.endpoint = endpoint.rstrip('/')
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.transform = transform
+        self.on_done = on_done  # called with the path of each finished download
+        self._session = requests.Session()
+        self._session.headers['Authorization'] = f"Bearer {token}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._pending = {}  # path -> future
+        self._discarded = set()
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        return self._pool
+
+    def submit(self, message_id, path):
+        """
+        Queues the download of message_id's content to path. Returns the
+        future, or None if path is already downloading or downloaded.
+        """
+        with self._lock:
+            if path in self._pending or os.path.exists(path) or os.path.exists(path + '.part'):
+                return None
+            # The .part file marks the download as in progress for every worker process
+            open(path + '.part', 'wb').close()
+            future = self._get_pool().submit(self._download, message_id, path)
+            self._pending[path] = future
+        future.add_done_callback(lambda f: self._done(path))
+        return future
+
+    def _done(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+            discarded = path in self._discarded
+            self._discarded.discard(path)
+        if discarded:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _download(self, message_id, path):
+        started = time.perf_counter()
+        part = path + '.part'
+        try:
+            url = f"{self.endpoint}/v2/bot/message/{message_id}/content"
+            with io.BytesIO() if self.transform else open(part, 'wb') as body:
+                with self._session.get(url, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(self.chunk_size):
+                        body.write(chunk)
+                metrics.record('download', time.perf_counter() - started)
+                if self.transform:
+                    # The connection is back in the pool before the (CPU-bound) re-encode
+                    self._store(body, part)
+            os.replace(part, path)
+        except Exception as e:
+            downloads_failed.inc()
+            print(f"Error downloading message {message_id}: {e}")
+            try:
+                os.remove(part)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            discarded = path in self._discarded
+        if self.on_done is not None and not discarded:  # No one wants it (see discard)
+            self.on_done(path)
+        return path
+
+    def _store(self, body, part):
+        head = body.getvalue()[:16]
+        image_format = sniff_format(head)
+        if image_format is None:
+            raise ValueError(f"not an image (starts with {head[:8]!r})")
+        uploads_by_format.inc(format=image_format)
+        upload_bytes.inc(body.tell(), stage='raw')
+        body.seek(0)
+        with metrics.timed('canonicalize'):
+            self.transform(body, part)
+        upload_bytes.inc(os.path.getsize(part), stage='stored')
+
+    def discard(self, paths):
+        """Marks downloads as unwanted: their files are deleted when they finish."""
+        with self._lock:
+            for path in paths:
+                if path in self._pending:
+                    self._discarded.add(path)
+
+    def wait(self, paths, timeout=120):
+        """
+        Waits for the downloads of paths and returns the ones that made it, in
+        order. Paths downloaded by another worker process are polled for.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            futures = [self._pending[p] for p in paths if p in self._pending]
+        wait_futures(futures, timeout=timeout)
+
+        ready = []
+        for path in paths:
+            while not os.path.exists(path):
+                # Still downloading elsewhere (a .part file), or failed
+                if not os.path.exists(path + '.part') or time.monotonic() > deadline:
+                    break
+                time.sleep(0.1)
+            if os.path.exists(path):
+                ready.append(path)
+        return ready
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
@@ -0,0 +1,124 @@
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from ratelimit import TokenBucket
+
+delivery_seconds = metrics.REGISTRY.histogram('line_delivery_seconds', 'From queueing a push to LINE accepting it (incl. waits and retries).')
+push_retries = metrics.REGISTRY.counter('line_push_retries_total', 'Push attempts retried, by reason.')
+push_failures = metrics.REGISTRY.counter('line_push_failures_total', 'Pushes given up on after all retries.')
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class PushError(Exception):
+    """A push LINE didn't accept (after retries, for retryable errors)."""
+
+
+class LineDelivery:
+    """
+    Sends push messages over one pooled keep-alive session, for every album.
+
+    - a global token bucket keeps all pushes under LINE's rate limit
+    - pushes to one user go out in the order they were queued; different
+      users are served in parallel by `workers` threads
+    - each chunk is retried on connection errors, 429 and 5xx with jittered
+      exponential backoff (honouring Retry-After). Every attempt carries the
+      same X-Line-Retry-Key, so LINE never delivers a chunk twice.
+    """
+
+    def __init__(self, token, endpoint='https://api.line.me', workers=8, rate=2000,
+                 retries=4, backoff=0.5, timeout=(5, 30)):
+        self.endpoint = endpoint.rstrip('/')
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._bucket = TokenBucket(rate=rate)
+        self._session = requests.Session()
+        self._session.headers['Authorization'] = f"Bearer {token}"
+        self._session.headers['Content-Type'] = 'application/json'
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._queues = {}  # user_id -> deque of (body, future, queued_at); present while draining
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="line-push")
+        return self._pool
+
+    def push(self, user_id, messages):
+        """Queues a push (up to 5 SDK message objects). Returns a Future."""
+        body = json.dumps({'to': user_id, 'messages': [m.as_json_dict() for m in messages]})
+        future = Future()
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+                self._get_pool().submit(self._drain, user_id)
+            queue.append((body, future, time.perf_counter()))
+        return future
+
+    def _drain(self, user_id):
+        # One drainer per user at a time keeps that user's pushes in order
+        while True:
+            with self._lock:
+                queue = self._queues[user_id]
+                if not queue:
+                    del self._queues[user_id]
+                    return
+                body, future, queued_at = queue.popleft()
+            try:
+                self._send(body)
+            except Exception as e:
+                push_failures.inc()
+                future.set_exception(e)
+            else:
+                delivery_seconds.observe(time.perf_counter() - queued_at)
+                future.set_result(None)
+
+    def _send(self, body):
+        retry_key = str(uuid.uuid4())
+        for attempt in range(self.retries + 1):
+            self._bucket.acquire(timeout=float('inf'))
+            retry_after = None
+            try:
+                response = self._session.post(
+                    f"{self.endpoint}/v2/bot/message/push", data=body,
+                    headers={'X-Line-Retry-Key': retry_key}, timeout=self.timeout,
+                )
+            except requests.RequestException as e:
+                reason, error = 'connection', e
+            else:
+                if response.status_code == 200:
+                    return
+                if response.status_code == 409 and 'x-line-accepted-request-id' in response.headers:
+                    return  # An earlier attempt got through
+                error = PushError(f"LINE push failed: {response.status_code} {response.text[:200]}")
+                if response.status_code not in RETRY_STATUS:
+                    raise error
+                reason = str(response.status_code)
+                retry_after = response.headers.get('Retry-After')
+
+            if attempt == self.retries:
+                raise error
+            push_retries.inc(reason=reason)
+            delay = random.uniform(0, self.backoff * 2 ** attempt)  # full jitter
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+    def pending(self):
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
@@ -0,0 +1,433 @@
+"""
+End-to-end load test: runs app.py under gunicorn against a local fake LINE
+Messaging API and a fake Gemini endpoint, replays signed webhook traffic
+(each user: "場所, 時期" -> N photos -> "完了") for a growing number of
+concurrent users, and reports webhook latency, album completion latency,
+throughput and peak memory per step.
+
+    python loadtest.py                                   # 1/5/10 users, 10 photos each
+    python loadtest.py --users 1,10,20 --photos 20 --workers 2
+    python loadtest.py --gemini-latency 3 --gemini-error-rate 0.2 --line-error-rate 0.05
+    python loadtest.py --env RENDER_PROCESSES=2 --out load.json
+
+Photos come from the bench_album.py corpus (12 MP JPEGs).
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from bench_album import build_corpus
+
+CHANNEL_SECRET = 'loadtest-secret'
+CAPTIONS = {"title": "渋谷旅行💖", "location_romaji": "Shibuya", "comment": "マジあげぽよ〜！"}
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class FakeServices:
+    """
+    One local HTTP server standing in for the LINE Messaging API (content,
+    reply, push) and the Gemini REST API, with configurable latency and
+    error rates. Records every push per user.
+    """
+
+    def __init__(self, photos, line_latency=0.02, line_error_rate=0.0, gemini_latency=0.5, gemini_error_rate=0.0):
+        self.photos = [open(p, 'rb').read() for p in photos]
+        self.line_latency = line_latency
+        self.line_error_rate = line_error_rate
+        self.gemini_latency = gemini_latency
+        self.gemini_error_rate = gemini_error_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b'', content_type='application/json', headers=()):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for k, v in headers:
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                m = re.match(r'/v2/bot/message/(\d+)/content', self.path)
+                if not m:
+                    return self._send(404)
+                time.sleep(fake.line_latency)
+                with fake.lock:
+                    fake.downloads += 1
+                self._send(200, fake.photos[int(m.group(1)) % len(fake.photos)], 'image/jpeg')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if ':generateContent' in self.path:
+                    return self._gemini()
+                time.sleep(fake.line_latency)
+                if self.path == '/v2/bot/message/reply':
+                    with fake.lock:
+                        fake.replies += 1
+                    return self._send(200, b'{}')
+                if self.path != '/v2/bot/message/push':
+                    return self._send(404)
+
+                retry_key = self.headers.get('X-Line-Retry-Key')
+                with fake.lock:
+                    if retry_key and retry_key in fake.accepted:
+                        return self._send(409, b'{}', headers=[('x-line-accepted-request-id', retry_key)])
+                    if random.random() < fake.line_error_rate:
+                        fake.push_errors += 1
+                        return self._send(random.choice([429, 500, 503]), b'{}')
+                    if retry_key:
+                        fake.accepted.add(retry_key)
+                    data = json.loads(body)
+                    fake.pushes.setdefault(data['to'], []).append(
+                        (time.time(), [msg['type'] for msg in data['messages']],
+                         any('ごめん' in msg.get('text', '') for msg in data['messages'])))
+                self._send(200, b'{}')
+
+            def _gemini(self):
+                time.sleep(fake.gemini_latency)
+                with fake.lock:
+                    fake.gemini_calls += 1
+                if random.random() < fake.gemini_error_rate:
+                    return self._send(503, b'{"error": {"code": 503, "message": "fake overload", "status": "UNAVAILABLE"}}')
+                text = json.dumps(CAPTIONS, ensure_ascii=False)
+                out = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                                       "finishReason": "STOP", "index": 0}]}
+                self._send(200, json.dumps(out).encode())
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.pushes = {}  # user_id -> [(time, message types, is_error)]
+            self.accepted = set()
+            self.downloads = 0
+            self.replies = 0
+            self.push_errors = 0
+            self.gemini_calls = 0
+
+
+class App:
+    """app.py under gunicorn, pointed at the fakes."""
+
+    def __init__(self, fakes, workers, threads, extra_env, workdir):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(workdir, 'gunicorn.log')
+        env = dict(os.environ)
+        env.update({
+            'CHANNEL_ACCESS_TOKEN': 'loadtest-token',
+            'CHANNEL_SECRET': CHANNEL_SECRET,
+            'GEMINI_API_KEY': 'loadtest-key',
+            'GEMINI_API_ENDPOINT': fakes.url,
+            'LINE_API_ENDPOINT': fakes.url,
+            'LINE_DATA_ENDPOINT': fakes.url,
+            'HOST_URL': self.url,
+            'ALBUM_OUTPUT_DIR': os.path.join(workdir, 'images'),
+            'ALBUM_CACHE_DIR': os.path.join(workdir, 'albums'),
+            'PYTHONUNBUFFERED': '1',
+        })
+        if workers > 1:
+            env.update({'SESSION_STORE': 'sqlite', 'SESSION_DB': os.path.join(workdir, 'sessions.db')})
+        env.update(extra_env)
+
+        started = time.perf_counter()
+        self.log = open(self.log_path, 'w')
+        self.proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+             '--bind', f'127.0.0.1:{self.port}', '--timeout', '120', 'app:app'],
+            env=env, stdout=self.log, stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        # Ready = answering HTTP (what a platform health check sees)
+        while True:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"gunicorn exited, see {self.log_path}")
+            try:
+                requests.get(f"{self.url}/jobs", timeout=1)
+                break
+            except requests.RequestException:
+                time.sleep(0.05)
+        self.startup_s = time.perf_counter() - started
+
+    def _pids(self):
+        # gunicorn master + its worker processes
+        pids = [self.proc.pid]
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat') as f:
+                        ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                if ppid == self.proc.pid:
+                    pids.append(int(entry))
+        return pids
+
+    def memory_mb(self):
+        """
+        {'total': sum of VmHWM over master + workers, 'max_worker': largest
+        worker VmHWM, 'pss': current proportional set size of them all}.
+        RSS counts pages shared with the master in every worker; PSS splits them.
+        """
+        peaks = {}
+        pss = 0.0
+        for pid in self._pids():
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmHWM:'):
+                            peaks[pid] = int(line.split()[1]) / 1024
+                with open(f'/proc/{pid}/smaps_rollup') as f:
+                    for line in f:
+                        if line.startswith('Pss:'):
+                            pss += int(line.split()[1]) / 1024
+            except OSError:
+                pass
+        workers = [mb for pid, mb in peaks.items() if pid != self.proc.pid]
+        return {'total': sum(peaks.values()), 'max_worker': max(workers, default=0.0), 'pss': pss}
+
+    def idle(self, polls):
+        # /jobs answers for whichever worker takes the request, so ask several times
+        for _ in range(polls):
+            try:
+                stats = requests.get(f"{self.url}/jobs", timeout=5).json()
+            except requests.RequestException:
+                return False
+            if stats['queued'] or stats['running']:
+                return False
+        return True
+
+    def stop(self):
+        self.proc.send_signal(signal.SIGTERM)
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.log.close()
+
+
+class User:
+    """One simulated LINE user: sets the trip, sends photos, then "完了"."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, index, app_url, photos, rng):
+        self.user_id = f"Uload{index:05d}{uuid.uuid4().hex[:8]}"
+        self.app_url = app_url
+        self.photos = photos
+        self.rng = rng
+        self.http = requests.Session()
+        self.webhook_latencies = []
+        self.webhook_errors = 0
+        self.done_at = None
+
+    def _post(self, message):
+        event = {
+            'type': 'message',
+            'mode': 'active',
+            'timestamp': int(time.time() * 1000),
+            'source': {'type': 'user', 'userId': self.user_id},
+            'webhookEventId': uuid.uuid4().hex.upper()[:26],
+            'deliveryContext': {'isRedelivery': False},
+            'replyToken': uuid.uuid4().hex,
+            'message': dict(message, id=str(next(self._ids))),
+        }
+        body = json.dumps({'destination': 'Uloadtestbot', 'events': [event]}, ensure_ascii=False).encode()
+        signature = base64.b64encode(hmac.new(CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+        started = time.perf_counter()
+        try:
+            response = self.http.post(f"{self.app_url}/callback", data=body, timeout=30,
+                                      headers={'X-Line-Signature': signature, 'Content-Type': 'application/json'})
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        self.webhook_latencies.append(time.perf_counter() - started)
+        if not ok:
+            self.webhook_errors += 1
+
+    def run(self, start_delay):
+        time.sleep(start_delay)
+        self._post({'type': 'text', 'text': '渋谷, 2024夏'})
+        time.sleep(self.rng.uniform(1, 3))  # picking photos in the gallery
+        for _ in range(self.photos):
+            self._post({'type': 'image', 'contentProvider': {'type': 'line'}})
+            time.sleep(self.rng.uniform(0.05, 0.3))  # LINE delivers a multi-select as a quick burst
+        time.sleep(self.rng.uniform(0.5, 2))
+        self.done_at = time.time()
+        self._post({'type': 'text', 'text': '完了'})
+
+
+def run_step(fakes, users, args, extra_env):
+    """Starts a fresh app, runs `users` concurrent users, returns the step's measurements."""
+    fakes.reset()
+    with tempfile.TemporaryDirectory() as workdir:
+        app = App(fakes, args.workers, args.threads, extra_env, workdir)
+        try:
+            rng = random.Random(users)
+            sims = [User(i, app.url, args.photos, random.Random(rng.random())) for i in range(users)]
+            started = time.time()
+            threads = [threading.Thread(target=u.run, args=(rng.uniform(0, args.ramp),)) for u in sims]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            # An album is over when it has had its pages (or the error message) pushed,
+            # no pushes for a while, and no job is queued or running anywhere
+            deadline = time.time() + args.timeout
+            timed_out = False
+            while True:
+                now = time.time()
+                with fakes.lock:
+                    pushes = {u: list(p) for u, p in fakes.pushes.items()}
+                finished = all(
+                    any('image' in kinds or is_error for _, kinds, is_error in pushes.get(u.user_id, []))
+                    for u in sims
+                )
+                last_push = max((p[-1][0] for p in pushes.values()), default=started)
+                if finished and now - last_push > args.settle and app.idle(polls=4 * args.workers):
+                    break
+                if now > deadline:
+                    timed_out = True
+                    break
+                time.sleep(0.2)
+
+            memory = app.memory_mb()
+        finally:
+            app.stop()
+
+    completion, first_page, failed = [], [], 0
+    for u in sims:
+        user_pushes = [p for p in pushes.get(u.user_id, []) if p[0] >= u.done_at]
+        if any(is_error for _, _, is_error in user_pushes):
+            failed += 1
+            continue
+        images = [t for t, kinds, _ in user_pushes if 'image' in kinds]
+        if images:
+            first_page.append(images[0] - u.done_at)
+            completion.append(user_pushes[-1][0] - u.done_at)
+        else:
+            failed += 1
+
+    latencies = [x for u in sims for x in u.webhook_latencies]
+    end = max([started] + [p[-1][0] for p in pushes.values()])
+    wall = end - started
+    return {
+        'users': users,
+        'photos_per_user': args.photos,
+        'startup_s': app.startup_s,
+        'webhooks': len(latencies),
+        'webhook_errors': sum(u.webhook_errors for u in sims),
+        'webhook_p50_ms': _percentile(latencies, 50) * 1000,
+        'webhook_p99_ms': _percentile(latencies, 99) * 1000,
+        'albums_done': len(completion),
+        'albums_failed': failed,
+        'timed_out': timed_out,
+        'album_p50_s': _percentile(completion, 50),
+        'album_p99_s': _percentile(completion, 99),
+        'first_page_p50_s': _percentile(first_page, 50),
+        'albums_per_min': len(completion) / wall * 60 if wall else 0.0,
+        'photos_per_s': fakes.downloads / wall if wall else 0.0,
+        'wall_s': wall,
+        'peak_rss_total_mb': memory['total'],
+        'peak_rss_worker_mb': memory['max_worker'],
+        'pss_total_mb': memory['pss'],
+        'gemini_calls': fakes.gemini_calls,
+        'push_errors_injected': fakes.push_errors,
+    }
+
+
+def _fmt(v, spec):
+    return '-' if v is None else format(v, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', default='1,5,10', help='concurrent users per step, comma separated')
+    parser.add_argument('--photos', type=int, default=10, help='photos each user sends')
+    parser.add_argument('--ramp', type=float, default=5, help='users start spread over this many seconds')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers (>1 uses the SQLite session store)')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--photo-pool', type=int, default=20, help='distinct corpus photos served by the fake LINE')
+    parser.add_argument('--line-latency', type=float, default=0.02, help='fake LINE API latency (s)')
+    parser.add_argument('--line-error-rate', type=float, default=0.0, help='share of pushes answered with 429/5xx')
+    parser.add_argument('--gemini-latency', type=float, default=0.5, help='fake Gemini latency (s)')
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0, help='share of Gemini calls that fail')
+    parser.add_argument('--settle', type=float, default=3, help='seconds without pushes before a step counts as done')
+    parser.add_argument('--timeout', type=float, default=600, help='give up on a step after this many seconds')
+    parser.add_argument('--env', action='append', default=[], help='extra app env, KEY=VALUE (repeatable)')
+    parser.add_argument('--out', help='write results JSON here')
+    args = parser.parse_args()
+
+    extra_env = dict(kv.split('=', 1) for kv in args.env)
+    photos = build_corpus(args.photo_pool)['paths']
+    fakes = FakeServices(photos, args.line_latency, args.line_error_rate, args.gemini_latency, args.gemini_error_rate)
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'threads': args.threads,
+        'env': extra_env,
+        'results': [],
+    }
+    print(f"{'users':>5} {'webhook p50/p99 ms':>19} {'album p50/p99 s':>16} {'1st page':>8} "
+          f"{'albums/min':>10} {'photos/s':>8} {'rss MB':>7} {'pss MB':>7} {'worker':>7} {'start s':>7} {'failed':>6}")
+    for users in [int(u) for u in args.users.split(',')]:
+        r = run_step(fakes, users, args, extra_env)
+        results['results'].append(r)
+        print(f"{users:>5} {_fmt(r['webhook_p50_ms'], '9.1f')}/{_fmt(r['webhook_p99_ms'], '<9.1f')}"
+              f" {_fmt(r['album_p50_s'], '7.1f')}/{_fmt(r['album_p99_s'], '<8.1f')} {_fmt(r['first_page_p50_s'], '8.1f')}"
+              f" {r['albums_per_min']:>10.1f} {r['photos_per_s']:>8.1f} {r['peak_rss_total_mb']:>7.0f} {r['pss_total_mb']:>7.0f}"
+              f" {r['peak_rss_worker_mb']:>7.0f} {r['startup_s']:>7.2f} {r['albums_failed']:>6}"
+              + ('  TIMED OUT' if r['timed_out'] else ''))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Tiny in-process metrics: counters, gauges and histograms, rendered in the
+Prometheus text format for /metrics. Stage timings go through timed(), which
+also feeds the current thread's AlbumTrace (if one is running).
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_str(labels):
+    if not labels:
+        return ''
+    parts = []
+    for k, v in labels:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _fmt(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items()) or [((), 0)]
+        for key, v in values:
+            lines.append(f"{self.name}{_label_str(key)} {_fmt(v)}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time."""
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            print(f"Error reading gauge {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_fmt(value)}"]
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, n in zip(self.buckets + (float('inf'),), series[:-2] + [series[-1]]):
+                    lines.append(f"{self.name}_bucket{_label_str(key + (('le', _fmt(bound)),))} {n}")
+                lines.append(f"{self.name}_sum{_label_str(key)} {_fmt(series[-2])}")
+                lines.append(f"{self.name}_count{_label_str(key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_add(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help):
+        return self._get_or_add(name, lambda: Counter(name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._get_or_add(name, lambda: Histogram(name, help, buckets))
+
+    def gauge(self, name, help, func):
+        return self._get_or_add(name, lambda: Gauge(name, help, func))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+stage_seconds = REGISTRY.histogram('album_stage_seconds', 'Time spent per pipeline stage.')
+photos_received = REGISTRY.counter('album_photos_received_total', 'Photos received from users.')
+duplicates_dropped = REGISTRY.counter('album_duplicates_dropped_total', 'Near-duplicate photos dropped.')
+pages_produced = REGISTRY.counter('album_pages_produced_total', 'Album pages rendered.')
+time_to_first_page = REGISTRY.histogram('album_time_to_first_page_seconds', 'From "完了" to the first album page delivered.')
+
+
+class AlbumTrace:
+    """Per-album stage breakdown (total seconds and call count per stage)."""
+
+    def __init__(self, label=''):
+        self.label = label
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, count + 1)
+
+    def summary(self):
+        parts = [f"total={time.perf_counter() - self.started:.3f}s"]
+        with self._lock:
+            stages = list(self.stages.items())
+        for stage, (total, count) in stages:
+            parts.append(f"{stage}={total:.3f}s" + (f"(x{count})" if count > 1 else ''))
+        return f"album trace {self.label}: " + ' '.join(parts)
+
+
+_local = threading.local()
+
+
+def start_trace(label=''):
+    _local.trace = AlbumTrace(label)
+    return _local.trace
+
+
+def end_trace():
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def bind_trace(func):
+    """Wraps func so it records into the caller's current trace from any thread."""
+    trace = current_trace()
+    def wrapper(*args, **kwargs):
+        previous = current_trace()
+        _local.trace = trace
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.trace = previous
+    return wrapper
+
+
+def record(stage, seconds):
+    """Records a stage timing in the histogram and the current trace."""
+    stage_seconds.observe(seconds, stage=stage)
+    trace = current_trace()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t)
@@ -0,0 +1,86 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """sha256 of a file's content (hex)."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PhotoMetaCache:
+    """
+    Per-photo metadata (phash, size, orientation, thumbnail) computed in the
+    background as photos arrive, so "完了" only has to look values up.
+    Entries are keyed by content digest (LRU), so a re-sent photo is never
+    decoded or hashed twice; paths just map to their digest.
+    """
+
+    def __init__(self, describe, max_entries=2000, workers=2):
+        self._describe = describe  # path -> metadata dict
+        self.max_entries = max_entries
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._by_digest = OrderedDict()
+        self._path_digest = {}
+        self._pending = {}  # path -> future
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="photo-meta")
+        return self._pool
+
+    def submit(self, path):
+        """Starts computing metadata for path in the background."""
+        with self._lock:
+            if path in self._path_digest or path in self._pending:
+                return
+            future = self._get_pool().submit(self._compute, path)
+            self._pending[path] = future
+        future.add_done_callback(lambda f: self._done(path))
+
+    def _done(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def _compute(self, path):
+        digest = file_digest(path)
+        with self._lock:
+            meta = self._by_digest.get(digest)
+            if meta is not None:
+                self._by_digest.move_to_end(digest)
+                self._path_digest[path] = digest
+                return meta
+
+        meta = dict(self._describe(path), digest=digest)
+
+        with self._lock:
+            self._by_digest[digest] = meta
+            while len(self._by_digest) > self.max_entries:
+                self._by_digest.popitem(last=False)
+            self._path_digest[path] = digest
+        return meta
+
+    def get(self, path):
+        """Metadata for path: waits for a pending job, or computes it inline on a miss."""
+        with self._lock:
+            future = self._pending.get(path)
+            digest = self._path_digest.get(path)
+            meta = self._by_digest.get(digest) if digest else None
+        if future is not None:
+            return future.result()
+        if meta is not None:
+            return meta
+        return self._compute(path)
+
+    def forget(self, paths):
+        """Drops path -> digest mappings (content entries stay cached)."""
+        with self._lock:
+            for p in paths:
+                self._path_digest.pop(p, None)
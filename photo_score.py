@@ -0,0 +1,89 @@
+"""
+Cheap photo-quality scores computed on small thumbnails, vectorized over the
+whole batch with NumPy (no per-photo Python loops over pixels).
+
+Each component is in [0, 1], higher is better:
+- sharpness:  variance of the Laplacian (blurry/shaky shots score low)
+- exposure:   mid-tone brightness, minus clipped shadows/highlights
+- contrast:   spread of luminance
+- saturation: colourfulness (HSV-style (max - min) / max)
+- faces:      share of skin-tone pixels in the centre (YCbCr box), a cheap
+              stand-in for "there are people in this photo"
+"""
+import numpy as np
+from PIL import Image
+
+SCORE_SIDE = 64  # thumbnails are resized to SCORE_SIDE x SCORE_SIDE for scoring
+
+WEIGHTS = {
+    'sharpness': 0.35,
+    'exposure': 0.2,
+    'contrast': 0.15,
+    'saturation': 0.1,
+    'faces': 0.2,
+}
+
+
+def _stack(thumbnails):
+    """(N, S, S, 3) float32 array in [0, 1]."""
+    return np.stack([
+        np.asarray(im.convert('RGB').resize((SCORE_SIDE, SCORE_SIDE), Image.BILINEAR), dtype=np.float32)
+        for im in thumbnails
+    ]) / 255.0
+
+
+def score_components(thumbnails):
+    """Returns {component: (N,) array} for a list of PIL thumbnails."""
+    if not thumbnails:
+        return {name: np.zeros(0, dtype=np.float32) for name in WEIGHTS}
+    rgb = _stack(thumbnails)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    luma = 0.299 * r + 0.587 * g + 0.114 * b
+
+    # 4-neighbour Laplacian over the batch via slicing
+    lap = (luma[:, :-2, 1:-1] + luma[:, 2:, 1:-1] + luma[:, 1:-1, :-2] + luma[:, 1:-1, 2:]
+           - 4 * luma[:, 1:-1, 1:-1])
+    # Typical variance is ~1e-4 (blurred) to ~1e-2 (crisp) at this size; log-scale into [0, 1]
+    sharpness = np.clip((np.log10(lap.var(axis=(1, 2)) + 1e-6) + 4) / 2, 0, 1)
+
+    mean = luma.mean(axis=(1, 2))
+    clipped = ((luma < 0.02) | (luma > 0.98)).mean(axis=(1, 2))
+    exposure = np.clip(1 - np.abs(mean - 0.5) * 2 - clipped, 0, 1)
+
+    contrast = np.clip(luma.std(axis=(1, 2)) / 0.25, 0, 1)
+
+    cmax = rgb.max(axis=3)
+    cmin = rgb.min(axis=3)
+    saturation = np.clip(((cmax - cmin) / np.maximum(cmax, 1e-3)).mean(axis=(1, 2)) / 0.5, 0, 1)
+
+    # Skin tones sit in a small Cb/Cr box regardless of brightness
+    q = SCORE_SIDE // 4
+    cb = 0.5 - 0.168736 * r - 0.331264 * g + 0.5 * b
+    cr = 0.5 + 0.5 * r - 0.418688 * g - 0.081312 * b
+    skin = (cb > 77 / 255) & (cb < 127 / 255) & (cr > 133 / 255) & (cr < 173 / 255) & (luma > 0.15)
+    faces = np.clip(skin[:, q:-q, q:-q].mean(axis=(1, 2)) / 0.15, 0, 1)
+
+    return {
+        'sharpness': sharpness,
+        'exposure': exposure,
+        'contrast': contrast,
+        'saturation': saturation,
+        'faces': faces,
+    }
+
+
+def score_photos(thumbnails, weights=WEIGHTS):
+    """One quality score in [0, 1] per thumbnail ((N,) array)."""
+    components = score_components(thumbnails)
+    total = np.zeros(len(thumbnails), dtype=np.float32)
+    for name, weight in weights.items():
+        total += weight * components[name]
+    return total / sum(weights.values())
+
+
+def top_indices(scores, count):
+    """Indices of the `count` best scores, in their original (album) order."""
+    if count >= len(scores):
+        return list(range(len(scores)))
+    best = np.argsort(-np.asarray(scores), kind='stable')[:count]
+    return sorted(int(i) for i in best)
@@ -0,0 +1,205 @@
+import abc
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from ttl_cache import TTLCache
+
+
+def new_session():
+    return {'status': 'idle', 'images': [], 'location': '', 'date': '', 'updated_at': time.time()}
+
+
+class SessionStore(abc.ABC):
+    """
+    Per-user conversation state:
+    { 'status': 'idle'|'collecting', 'location': str, 'date': str, 'images': [path, ...], 'updated_at': float }
+
+    All changes go through transaction(), which hands out a copy of the
+    session and saves it back atomically when the block exits (nothing is
+    saved if the block raises). Keep network calls out of the block.
+    """
+
+    @abc.abstractmethod
+    def transaction(self, user_id):
+        """Context manager yielding a copy of the session; saved on exit (see above)."""
+
+    @abc.abstractmethod
+    def get(self, user_id):
+        """A snapshot of the user's session (a fresh idle one if there is none)."""
+
+    @abc.abstractmethod
+    def evict_idle(self, ttl):
+        """Removes sessions idle for more than ttl seconds and returns them."""
+
+    @abc.abstractmethod
+    def count(self):
+        """Number of stored sessions."""
+
+    @abc.abstractmethod
+    def first_delivery(self, event_id):
+        """
+        Records a webhook event id. Returns False if it was already seen
+        (a redelivery), True the first time.
+        """
+
+    @abc.abstractmethod
+    def forget_delivery(self, event_id):
+        """Un-records an event id, so a redelivery of an event that failed is handled again."""
+
+    def append_image(self, user_id, path):
+        """
+        Adds path to a collecting session. Returns the new image count, or
+        None if the user isn't collecting photos.
+        """
+        with self.transaction(user_id) as session:
+            if session['status'] != 'collecting':
+                return None
+            if path not in session['images']:  # Same message delivered twice
+                session['images'].append(path)
+            return len(session['images'])
+
+    def reset(self, user_id):
+        """Drops the user's session and returns the old one."""
+        with self.transaction(user_id) as session:
+            old = dict(session)
+            session.clear()
+            session.update(new_session())
+            return old
+
+
+class MemorySessionStore(SessionStore):
+    """Process-local store. Only correct with a single gunicorn worker."""
+
+    def __init__(self, event_ttl=24 * 3600):
+        self._sessions = {}
+        self._lock = threading.RLock()
+        self._events = TTLCache(max_entries=10000, ttl=event_ttl)
+
+    @contextmanager
+    def transaction(self, user_id):
+        with self._lock:
+            session = copy.deepcopy(self._sessions.get(user_id)) or new_session()
+            yield session
+            session['updated_at'] = time.time()
+            self._sessions[user_id] = session
+
+    def get(self, user_id):
+        with self._lock:
+            return copy.deepcopy(self._sessions.get(user_id)) or new_session()
+
+    def evict_idle(self, ttl):
+        cutoff = time.time() - ttl
+        with self._lock:
+            expired = [uid for uid, s in self._sessions.items() if s['updated_at'] < cutoff]
+            return [self._sessions.pop(uid) for uid in expired]
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def first_delivery(self, event_id):
+        return self._events.add(event_id)
+
+    def forget_delivery(self, event_id):
+        self._events.pop(event_id)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store shared by every worker process on the host, in one SQLite file
+    (WAL mode: readers don't block the writer). Each transaction takes the
+    write lock up front (BEGIN IMMEDIATE), so concurrent read-modify-writes
+    from different processes are serialized instead of losing updates.
+    """
+
+    def __init__(self, path='sessions.db', timeout=10, event_ttl=24 * 3600):
+        self.path = path
+        self.timeout = timeout
+        self.event_ttl = event_ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS events (event_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS events_seen_at ON events (seen_at)")
+
+    def _conn(self):
+        # One connection per thread (and per process: opened after fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _load(self, conn, user_id):
+        row = conn.execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else new_session()
+
+    @contextmanager
+    def transaction(self, user_id):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            session = self._load(conn, user_id)
+            yield session
+            session['updated_at'] = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, json.dumps(session, ensure_ascii=False), session['updated_at']),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get(self, user_id):
+        return self._load(self._conn(), user_id)
+
+    def evict_idle(self, ttl):
+        conn = self._conn()
+        cutoff = time.time() - ttl
+        # SELECT then DELETE under the write lock (DELETE ... RETURNING needs SQLite 3.35+)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Runs periodically, so old event ids are pruned here too
+            conn.execute("DELETE FROM events WHERE seen_at < ?", (time.time() - self.event_ttl,))
+            rows = conn.execute("SELECT data FROM sessions WHERE updated_at < ?", (cutoff,)).fetchall()
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return [json.loads(data) for (data,) in rows]
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def first_delivery(self, event_id):
+        cursor = self._conn().execute(
+            "INSERT OR IGNORE INTO events (event_id, seen_at) VALUES (?, ?)", (event_id, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def forget_delivery(self, event_id):
+        self._conn().execute("DELETE FROM events WHERE event_id = ?", (event_id,))
+
+
+def create_session_store():
+    """Picks the backend from SESSION_STORE (memory | sqlite)."""
+    backend = os.getenv('SESSION_STORE', 'memory')
+    if backend == 'sqlite':
+        return SQLiteSessionStore(os.getenv('SESSION_DB', 'sessions.db'))
+    if backend != 'memory':
+        raise ValueError(f"Unknown SESSION_STORE: {backend}")
+    return MemorySessionStore()
@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+
+import pytest
+
+from gemini_service import GeminiService
+
+CAPTIONS = {"title": "渋谷💖", "location_romaji": "Shibuya", "comment": "あげぽよ"}
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel: answers, raises or hangs."""
+
+    def __init__(self, mode='ok'):
+        self.mode = mode
+        self.calls = []
+        self.released = threading.Event()
+
+    def generate_content(self, contents, request_options=None):
+        self.calls.append(request_options)
+        if self.mode == 'error':
+            raise RuntimeError("500 Internal error")
+        if self.mode == 'hang':
+            # Like the SDK, give up at the request timeout
+            if not self.released.wait(request_options['timeout']):
+                raise TimeoutError("deadline exceeded")
+        return FakeResponse(json.dumps(CAPTIONS))
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv('GEMINI_TIMEOUT', '0.2')
+    monkeypatch.setenv('GEMINI_CONCURRENCY', '8')
+    monkeypatch.setenv('GEMINI_RPM', '60000')
+    made = []
+
+    def make(mode):
+        svc = GeminiService(model=FakeModel(mode))
+        made.append(svc)
+        return svc
+    yield make
+    for svc in made:
+        svc.model.released.set()
+
+
+def caption(svc, i):
+    started = time.monotonic()
+    result = svc.generate_captions(f"place {i}", "2024夏")
+    return result, time.monotonic() - started
+
+
+def test_ok_is_cached(service):
+    svc = service('ok')
+    assert caption(svc, 0)[0] == CAPTIONS
+    assert caption(svc, 0)[0] == CAPTIONS
+    assert len(svc.model.calls) == 1
+
+
+def test_timeout_falls_back_within_budget_and_opens_circuit(service):
+    svc = service('hang')
+    for i in range(5):
+        result, elapsed = caption(svc, i)
+        assert result == svc._fallback_captions(f"place {i}")
+        assert elapsed < svc.timeout + 0.15
+    assert svc._breaker.state == 'open'
+
+    # Open: immediate fallback, no call made
+    calls = len(svc.model.calls)
+    result, elapsed = caption(svc, 99)
+    assert result == svc._fallback_captions("place 99")
+    assert elapsed < 0.05
+    assert len(svc.model.calls) == calls
+
+
+def test_hung_request_has_a_deadline_and_frees_its_slot(service):
+    svc = service('hang')
+    caption(svc, 0)
+    assert svc.model.calls[0] == {'timeout': svc.request_timeout}
+    time.sleep(svc.request_timeout + 0.1)
+    # Every slot is back once the SDK gives up
+    assert all(svc._slots.acquire(blocking=False) for _ in range(svc.concurrency))
+
+
+def test_errors_fall_back_and_open_circuit(service):
+    svc = service('error')
+    for i in range(5):
+        result, elapsed = caption(svc, i)
+        assert result == svc._fallback_captions(f"place {i}")
+        assert elapsed < 0.1
+    assert svc._breaker.state == 'open'
+    caption(svc, 99)
+    assert len(svc.model.calls) == 5
+
+
+def test_circuit_closes_after_successful_trial(service):
+    svc = service('error')
+    for i in range(5):
+        caption(svc, i)
+    svc._breaker.reset_timeout = 0
+    svc.model.mode = 'ok'
+    assert caption(svc, 50)[0] == CAPTIONS
+    assert svc._breaker.state == 'closed'
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from hash_index import MultiIndexHash, cluster_hashes, hamming
+
+
+def brute_force_clusters(hashes, cutoff):
+    """The old pairwise dedup loop: compare each hash with every kept hash."""
+    clusters = []
+    leaders = []  # (hash, cluster index), in the order they were kept
+    for i, h in enumerate(hashes):
+        if h is None:
+            clusters.append([i])
+            continue
+        for leader, c in leaders:
+            if hamming(h, leader) < cutoff:
+                clusters[c].append(i)
+                break
+        else:
+            leaders.append((h, len(clusters)))
+            clusters.append([i])
+    return clusters
+
+
+def flip_bits(h, count, rng):
+    for bit in rng.sample(range(64), count):
+        h ^= 1 << bit
+    return h
+
+
+def random_hashes(seed, n, cutoff, none_rate=0.05):
+    """Random 64-bit hashes plus near-duplicates at and around the cutoff."""
+    rng = random.Random(seed)
+    hashes = []
+    for _ in range(n):
+        r = rng.random()
+        if r < none_rate:
+            hashes.append(None)
+        elif r < 0.5 or not any(h is not None for h in hashes):
+            hashes.append(rng.getrandbits(64))
+        else:
+            base = rng.choice([h for h in hashes if h is not None])
+            hashes.append(flip_bits(base, rng.choice([0, 1, cutoff - 1, cutoff, cutoff + 1]), rng))
+    return hashes
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("cutoff", [1, 5, 10])
+def test_cluster_hashes_matches_brute_force(seed, cutoff):
+    hashes = random_hashes(seed, 300, cutoff)
+    assert cluster_hashes(hashes, cutoff) == brute_force_clusters(hashes, cutoff)
+
+
+def test_cutoff_boundary():
+    rng = random.Random(0)
+    leader = rng.getrandbits(64)
+    near = flip_bits(leader, 9, rng)  # cutoff - 1: duplicate
+    far = flip_bits(leader, 10, rng)  # cutoff: not a duplicate
+    assert cluster_hashes([leader, near, far], cutoff=10) == [[0, 1], [2]]
+
+
+def test_none_entries_get_their_own_cluster():
+    assert cluster_hashes([None, 5, None, 5], cutoff=10) == [[0], [1, 3], [2]]
+
+
+def test_search_returns_everything_within_radius():
+    rng = random.Random(1)
+    hashes = [rng.getrandbits(64) for _ in range(200)]
+    hashes += [flip_bits(h, rng.randint(0, 12), rng) for h in hashes[:100]]
+    index = MultiIndexHash(radius=9)
+    for i, h in enumerate(hashes):
+        index.add(h, i)
+    for h in hashes[:50]:
+        expected = {(hamming(h, other), i) for i, other in enumerate(hashes) if hamming(h, other) <= 9}
+        assert set(index.search(h)) == expected
@@ -22,9 +22,11 @@ def main():
     svc = ImageService()
     print("Creating album...")
     try:
-        album = svc.create_album(paths, title="Test Album", date="2024 Summer")
-        album.save("test_album_output.jpg")
-        print("Success! Saved to test_album_output.jpg")
+        pages = svc.create_album_pages(paths, title="Test Album", date="2024 Summer", location_romaji="Test", seed=0)
+        for i, page in enumerate(pages):
+            out = "test_album_output.jpg" if i == 0 else f"test_album_output_{i}.jpg"
+            page.save(out)
+            print(f"Success! Saved to {out}")
     except Exception as e:
         print(f"Failed: {e}")
         import traceback
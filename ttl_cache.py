@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU map whose entries expire ttl seconds after they were set.
+    When full, the least recently used entry is dropped.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        # Cheap pass over the cold end; anything else expired is caught on lookup
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            del self._data[key]
+
+    def _lookup(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            item = self._lookup(key, now)
+            return default if item is None else item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def add(self, key, value=True):
+        """Sets key only if it isn't already there. Returns True if it was added."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if self._lookup(key, now) is not None:
+                return False
+            self._data[key] = (now + self.ttl, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None or item[0] <= time.monotonic() else item[1]
+
+    def __len__(self):
+        now = time.monotonic()
+        with self._lock:
+            self._data = OrderedDict((k, v) for k, v in self._data.items() if v[0] > now)
+            return len(self._data)